@@ -1,34 +1,158 @@
 import os
+import copy
 import shutil
 import time
 import json
-import uuid
 import re
-import requests
 import logging as log
 from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 
 from utils.video_helpers import *
-from moviepy.config import change_settings
+from utils.database_operations import DatabaseOperations
+from utils.disk_cache import DiskCache, hash_key, hash_file, link_or_copy
+from utils.render_cache import (
+    scene_render_stage,
+    link_segments,
+    segment_cache_key,
+    cached_segment,
+)
+from utils.project_store import (
+    save_project,
+    resolve_edit_request,
+    reusable_segment_keys,
+)
+from utils.scene_pipeline import ScenePipeline
+from utils import ffmpeg_backend
+from utils.audio_mixer import mix_timeline, MUSIC_DUCKING
+from utils.json_stream import JsonArrayStreamParser
+from PIL import Image, ImageOps
 import google.generativeai as genai
 
 
-change_settings({"IMAGEMAGICK_BINARY": os.getenv("IMAGE_MAGICK_PATH")})
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
 PEXEL_HEADERS = {"Authorization": os.getenv("PEXEL_API_KEY")}
 RES = (1280, 720)
 FPS = 24
+# Named aspect ratios for the "outputs" request option, "WxH" also works.
+OUTPUT_RESOLUTIONS = {
+    "16:9": RES,
+    "9:16": (720, 1280),
+    "1:1": (720, 720),
+    "4:5": (720, 900),
+}
+# Bounds for "WxH" outputs. Sizes must be even for yuv420p.
+MAX_OUTPUT_SIZE = int(os.getenv("MAX_OUTPUT_SIZE", 3840))
+PREVIEW_SCALE = 0.5
+PREVIEW_FPS = 12
 SAMPLE_RATE = 44100
 SUPPORTED_IMAGE_FORMATS = [".jpg", ".jpeg", ".png", ".webp", ".heic"]
 SUPPORTED_VIDEO_FORMATS = [".mp4", ".mov", ".mpeg", ".avi"]
+PEXEL_CACHE_TTL = int(os.getenv("PEXEL_CACHE_TTL", 7 * 24 * 3600))
+PEXEL_CACHE = DiskCache(
+    "pexels", int(os.getenv("PEXEL_CACHE_MAX_BYTES", 64 * 1024 * 1024)), suffix=".json"
+)
+# Bounding boxes of the resized Pexels photo sources, "crop" sizes are exact.
+PEXEL_PHOTO_SIZES = {
+    "tiny": (280, 200, "crop"),
+    "small": (None, 130, "fit"),
+    "medium": (None, 350, "fit"),
+    "landscape": (1200, 627, "crop"),
+    "large": (940, 650, "fit"),
+    "large2x": (1880, 1300, "fit"),
+}
+DESC_MODEL_NAME = "gemini-1.5-flash"
+DESCRIPTION_COLLECTION = "media_descriptions"
+# "upload" sends whole files through the Gemini File API, "keyframes" sends a
+# few locally sampled, downscaled frames inline with no upload or polling.
+MEDIA_ANALYSIS_MODE = os.getenv("MEDIA_ANALYSIS_MODE", "upload")
+ANALYSIS_IMAGE_SIZE = (1024, 1024)
+MEDIA_ANALYSIS_WORKERS = int(os.getenv("MEDIA_ANALYSIS_WORKERS", 8))
+MEDIA_ANALYSIS_TIMEOUT = int(os.getenv("MEDIA_ANALYSIS_TIMEOUT", 300))
+
+
+def parse_outputs(outputs=None):
+    # A list or comma-separated string of output names. The first one is the
+    # primary rendition, returned as signed_url.
+    if isinstance(outputs, str):
+        outputs = [name.strip() for name in outputs.split(",") if name.strip()]
+    if outputs is not None and not isinstance(outputs, list):
+        raise ValueError(f"Unsupported outputs: {outputs!r}")
+
+    resolved = {}
+    for name in outputs or ["16:9"]:
+        if not isinstance(name, str):
+            raise ValueError(f"Unsupported output: {name!r}")
+        if name in OUTPUT_RESOLUTIONS:
+            resolved[name] = OUTPUT_RESOLUTIONS[name]
+            continue
+        try:
+            width, height = (int(size) for size in name.lower().split("x"))
+        except ValueError:
+            raise ValueError(f"Unsupported output: {name}")
+        for size in (width, height):
+            if size < 2 or size > MAX_OUTPUT_SIZE or size % 2:
+                raise ValueError(
+                    f"Output sizes must be even and between 2 and "
+                    f"{MAX_OUTPUT_SIZE}: {name}"
+                )
+        resolved[name] = (width, height)
+    return list(resolved.items())
+
+
+def output_tag(name: str):
+    return re.sub(r"[^0-9A-Za-z]+", "x", name)
+
+
+def preview_resolution(res):
+    return tuple(max(int(size * PREVIEW_SCALE) // 2 * 2, 2) for size in res)
+
+
+def render_profiles(outputs, preview: bool = False):
+    prefix = "preview" if preview else "final"
+    return [f"{prefix}_{output_tag(name)}" for name, _ in outputs]
+
+
+def rendition_name(unique_folder_id: str, output_index: int, name: str):
+    # The primary rendition keeps the single-output name.
+    if output_index == 0:
+        return unique_folder_id + ".mp4"
+    return f"{unique_folder_id}_{output_tag(name)}.mp4"
+
+
+def join_renditions(scene_segment_paths, outputs, user_media_path: str, prefix: str):
+    # scene_segment_paths[scene][output] -> one stream-copied video per output.
+    video_paths = []
+    for output_index, (name, _) in enumerate(outputs):
+        segment_paths = link_segments(
+            [segment_paths[output_index] for segment_paths in scene_segment_paths],
+            os.path.join(user_media_path, "segments", output_tag(name)),
+        )
+        video_path = os.path.join(user_media_path, f"{prefix}_{output_tag(name)}.mp4")
+        video_paths.append(concatenate_segments(segment_paths, video_path))
+    return video_paths
+
+
+def profile_segment_keys(scene_segment_keys, profiles):
+    # scene_segment_keys[scene][output] -> {profile: [key per scene]}.
+    return {
+        profile: [segment_keys[output_index] for segment_keys in scene_segment_keys]
+        for output_index, profile in enumerate(profiles)
+    }
 
 
 class ContentCreator:
 
-    def __init__(self, DATABASE_OPERATIONS_SERVICE: any, user_video_options: dict = {}):
+    def __init__(
+        self,
+        DATABASE_OPERATIONS_SERVICE: any,
+        user_video_options: dict = {},
+        on_progress=None,
+    ):
         self.user_video_options = user_video_options
         self.DATABASE_OPERATIONS_SERVICE = DATABASE_OPERATIONS_SERVICE
+        self.on_progress = on_progress
         if not user_video_options:
             return
 
@@ -45,8 +169,11 @@ class ContentCreator:
         )
 
         self.uploaded_files_names = user_video_options["uploaded_files_names"]
+        self.uploaded_files_hashes = user_video_options.get("uploaded_files_hashes", {})
         self.user_media_path = os.path.join("temp", "new", self.unique_folder_id_param)
         self.use_stock_media = user_video_options["use_stock_media"]
+        self.outputs = parse_outputs(user_video_options.get("outputs"))
+        self.resolutions = [res for _, res in self.outputs]
         self.user_has_provided_media = user_video_options["user_has_provided_media"]
 
         self.create_dirs(self.user_media_path)
@@ -63,7 +190,7 @@ class ContentCreator:
 
         self.SYSTEM_MESSAGE += f"""\nYou MUST ONLY choose music, font and transitions from the following options: \n{config}."""
 
-        self.desc_model = genai.GenerativeModel("gemini-1.5-flash")
+        self.desc_model = genai.GenerativeModel(DESC_MODEL_NAME)
         self.video_model = genai.GenerativeModel(
             "gemini-1.5-flash", system_instruction=self.SYSTEM_MESSAGE
         )
@@ -73,11 +200,15 @@ class ContentCreator:
         img_file = genai.get_file(img_file.name)
         return img_file
 
-    def upload_vid(self, vid_path):
+    def upload_vid(self, vid_path, deadline: float = None):
         vid_file = genai.upload_file(vid_path)
+        poll_interval = 1
         while vid_file.state.name == "PROCESSING":
-            print(".", end="")
-            time.sleep(2)
+            if deadline and time.monotonic() + poll_interval > deadline:
+                genai.delete_file(vid_file.name)
+                raise TimeoutError(f"Timed out processing {vid_path}")
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, 8)
             vid_file = genai.get_file(vid_file.name)
 
         if vid_file.state.name == "FAILED":
@@ -85,12 +216,192 @@ class ContentCreator:
         else:
             return vid_file
 
+    def get_cached_description(self, cache_key: str):
+        try:
+            document = self.DATABASE_OPERATIONS_SERVICE.get_document(
+                DESCRIPTION_COLLECTION, cache_key
+            )
+        except Exception as e:
+            log.error(f"Failed to read media description cache: {e}")
+            return None
+        return document["desc"] if document else None
+
+    def cache_description(self, cache_key: str, desc: str):
+        try:
+            self.DATABASE_OPERATIONS_SERVICE.create_document(
+                DESCRIPTION_COLLECTION,
+                cache_key,
+                {"desc": desc, "model": DESC_MODEL_NAME, "created_at": time.time()},
+            )
+        except Exception as e:
+            log.error(f"Failed to write media description cache: {e}")
+
+    def get_keyframe_contents(
+        self, file_name: str, file_path: str, media_type: str, prompt: str
+    ):
+        if media_type == "image":
+            frame_paths = [file_path]
+        else:
+            frame_paths, duration = sample_keyframes(
+                file_path, os.path.join(self.user_media_path, "keyframes", file_name)
+            )
+            prompt = (
+                f"These are {len(frame_paths)} frames sampled in order from a "
+                f"{duration:.0f} second video. {prompt}"
+            )
+
+        frames = []
+        for frame_path in frame_paths:
+            with Image.open(frame_path) as image:
+                image = ImageOps.exif_transpose(image).convert("RGB")
+                image.thumbnail(ANALYSIS_IMAGE_SIZE)
+                frames.append(image)
+        return frames + [prompt]
+
+    def describe_media(self, file_name: str):
+        # Runs on a worker thread: uploads, polls and describes a single file
+        # within MEDIA_ANALYSIS_TIMEOUT. Failed files are left out of the prompt.
+        # Descriptions are cached by file content hash and prompt, so a cache
+        # hit skips the upload and the model call.
+        file_path = os.path.join(self.user_media_path, "media", file_name)
+        deadline = time.monotonic() + MEDIA_ANALYSIS_TIMEOUT
+        file_obj = None
+        prompt = None
+
+        try:
+            if any(file_path.endswith(ext) for ext in SUPPORTED_IMAGE_FORMATS):
+                media_type = "image"
+                prompt = "write a short one-sentence description for the image"
+            elif any(file_path.endswith(ext) for ext in SUPPORTED_VIDEO_FORMATS):
+                media_type = "video"
+                prompt = "write a short one-paragraph description for the video, depending on its duration."
+            else:
+                return None
+
+            content_hash = self.uploaded_files_hashes.get(file_name) or hash_file(
+                file_path
+            )
+            cache_key = hash_key(
+                content_hash, prompt, DESC_MODEL_NAME, MEDIA_ANALYSIS_MODE
+            )
+            desc = self.get_cached_description(cache_key)
+            if desc is not None:
+                log.info(f"Reusing cached description for {file_name}")
+                return {"source": file_path, "desc": desc}
+
+            if MEDIA_ANALYSIS_MODE == "keyframes":
+                contents = self.get_keyframe_contents(
+                    file_name, file_path, media_type, prompt
+                )
+            elif media_type == "image":
+                file_obj = self.upload_img(file_path)
+                contents = [file_obj, prompt]
+            else:
+                file_obj = self.upload_vid(file_path, deadline=deadline)
+                contents = [file_obj, prompt]
+
+            log.info(f"Generating description for {file_name}")
+            response = self.desc_model.generate_content(
+                contents,
+                request_options={"timeout": max(deadline - time.monotonic(), 1)},
+            )
+            self.cache_description(cache_key, response.text)
+            return {"source": file_path, "desc": response.text}
+        except Exception as e:
+            log.error(f"Failed to analyse {file_name}: {e}")
+            return None
+        finally:
+            if file_obj is not None:
+                genai.delete_file(file_obj.name)
+
+    def describe_all_media(self):
+        if not self.uploaded_files_names:
+            return []
+
+        workers = min(MEDIA_ANALYSIS_WORKERS, len(self.uploaded_files_names))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            descriptions = executor.map(self.describe_media, self.uploaded_files_names)
+            return [desc for desc in descriptions if desc is not None]
+
     def query_pexel(self, url):
-        response = requests.get(url, headers=PEXEL_HEADERS)
+        cache_key = hash_key(url)
+        cached_path = PEXEL_CACHE.get(cache_key)
+        if cached_path is not None:
+            try:
+                with open(cached_path, "r") as file:
+                    cached = json.load(file)
+                if time.time() - cached["fetched_at"] < PEXEL_CACHE_TTL:
+                    return cached["response"]
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+
+        response = get_http_session().get(url, headers=PEXEL_HEADERS)
         response.raise_for_status()
 
+        PEXEL_CACHE.put_bytes(
+            cache_key,
+            json.dumps({"fetched_at": time.time(), "response": response.json()}).encode(),
+        )
         return response.json()
 
+    def select_video_rendition(self, video_files, res=RES, fps=FPS):
+        # Smallest mp4 that still covers the render resolution and frame rate,
+        # otherwise the largest one available.
+        renditions = [
+            video
+            for video in video_files
+            if video.get("width") and video.get("height")
+            and video.get("file_type") == "video/mp4"
+        ]
+        if not renditions:
+            return video_files[0]["link"]
+
+        def covers(video):
+            return (
+                video["width"] >= res[0]
+                and video["height"] >= res[1]
+                and (video.get("fps") or fps) >= fps - 1
+            )
+
+        def area(video):
+            return video["width"] * video["height"]
+
+        covering = [video for video in renditions if covers(video)]
+        if covering:
+            best = min(
+                covering,
+                key=lambda video: (area(video), abs((video.get("fps") or fps) - fps)),
+            )
+        else:
+            best = max(renditions, key=area)
+        return best["link"]
+
+    def select_photo_source(self, photo, res=RES):
+        width, height = photo["width"], photo["height"]
+        sizes = {"original": (width, height)}
+        for name, (box_width, box_height, mode) in PEXEL_PHOTO_SIZES.items():
+            if name not in photo["src"]:
+                continue
+            if mode == "crop":
+                sizes[name] = (box_width, box_height)
+            else:
+                scale = box_height / height
+                if box_width:
+                    scale = min(scale, box_width / width)
+                scale = min(scale, 1)
+                sizes[name] = (int(width * scale), int(height * scale))
+
+        covering = [
+            name
+            for name, size in sizes.items()
+            if size[0] >= res[0] and size[1] >= res[1]
+        ]
+        if covering:
+            name = min(covering, key=lambda name: sizes[name][0] * sizes[name][1])
+        else:
+            name = max(sizes, key=lambda name: sizes[name][0] * sizes[name][1])
+        return photo["src"][name]
+
     def format_json(self, raw):
         match = re.search(r"```json(.*?)```", raw, re.DOTALL)
         if match:
@@ -111,6 +422,11 @@ class ContentCreator:
             file_content = file.read()
         return file_content
 
+    def report_progress(self, stage: str):
+        log.info(stage)
+        if self.on_progress:
+            self.on_progress(stage)
+
     def create_dirs(self, user_media_path: str):
         if not os.path.exists(os.path.join(user_media_path, "media")):
             os.makedirs(os.path.join(self.user_media_path, "media"))
@@ -118,154 +434,184 @@ class ContentCreator:
         if not os.path.exists(os.path.join(user_media_path, "audio")):
             os.makedirs(os.path.join(self.user_media_path, "audio"))
 
+    def prepare_scene_media(self, clip):
+        source, form = clip["type"].split("_")
+        if source == "stock":
+
+            if form == "video":
+                response = self.query_pexel(
+                    self.VID_PREF + quote(clip["query"])
+                )
+                media_url = self.select_video_rendition(
+                    response["videos"][0]["video_files"],
+                    res=cover_resolution(self.resolutions),
+                )
+                clip["media_url"] = media_url
+                file_path = download_stock_media(
+                    media_url, user_media_path=self.user_media_path
+                )
+
+            elif form == "photo":
+                response = self.query_pexel(
+                    self.IMG_PREF + quote(clip["query"])
+                )
+                media_url = self.select_photo_source(
+                    response["photos"][0], res=cover_resolution(self.resolutions)
+                )
+                clip["media_url"] = media_url
+                file_path = download_stock_media(
+                    media_url, user_media_path=self.user_media_path
+                )
+
+            clip["media_path"] = file_path
+            del clip["query"]
+
+        else:
+            # User media is stored under its content hash, so the same file
+            # from another request is neither uploaded nor signed again.
+            temp_media_path = clip["media_path"]
+            content_hash = self.uploaded_files_hashes.get(
+                os.path.basename(temp_media_path)
+            ) or hash_file(temp_media_path)
+            extension = os.path.splitext(temp_media_path)[1].lower()
+            user_media_unique_name = f"media/{content_hash}{extension}"
+            self.DATABASE_OPERATIONS_SERVICE.upload_file_by_path(
+                temp_media_path, user_media_unique_name, content_hash=content_hash
+            )
+            store_user_media(temp_media_path, content_hash)
+            user_media_signed_url = (
+                self.DATABASE_OPERATIONS_SERVICE.get_file_link(
+                    key=user_media_unique_name
+                )
+            )
+            clip["media_url"] = user_media_signed_url
+            # Signed URLs expire, so the project keeps the bucket key for edits.
+            clip["media_key"] = user_media_unique_name
+
+    def fetch_scene(self, index: int, clip: dict):
+        self.prepare_scene_media(clip)
+        return clip
+
+    def narrate_scene(self, index: int, clip: dict):
+        return synthesize_scene_narration(
+            index, clip, user_media_path=self.user_media_path
+        )
+
+    def generate_script(self, video_prompt: str):
+        # Streams the script and sends each scene through fetch, narration and
+        # segment rendering as soon as its JSON object is complete, overlapping
+        # the model latency with per-scene work.
+        parser = JsonArrayStreamParser("scenes")
+        raw_script = ""
+        streamed_scenes = []
+        segment_futures = []
+
+        with ThreadPoolExecutor(
+            max_workers=DOWNLOAD_WORKERS
+        ) as fetch_pool, ThreadPoolExecutor(max_workers=TTS_WORKERS) as tts_pool:
+            pipeline = ScenePipeline(
+                [
+                    (self.fetch_scene, fetch_pool),
+                    (self.narrate_scene, tts_pool),
+                    scene_render_stage(self.resolutions, FPS),
+                ]
+            )
+            for chunk in self.video_model.generate_content(video_prompt, stream=True):
+                raw_script += chunk.text
+                for clip in parser.feed(chunk.text):
+                    segment_futures.append(pipeline.submit(len(streamed_scenes), clip))
+                    streamed_scenes.append(clip)
+
+            segment_paths = [future.result() for future in segment_futures]
+            script = self.format_json(raw=raw_script)
+
+            if len(script["scenes"]) == len(streamed_scenes):
+                script["scenes"] = streamed_scenes
+            else:
+                log.error("Streamed scenes do not match the script, preparing again")
+                segment_paths = pipeline.run(script["scenes"])
+
+        return script, segment_paths
+
     def start_script_generation(self):
 
         if not self.title or not self.desc or not self.duration or not self.style:
             return
         else:
-            media_data = []
-            log.info("Analysing user media files")
-            for file_name in self.uploaded_files_names:
-                file_path = os.path.join(self.user_media_path, "media", file_name)
-                file_obj = None
-                prompt = None
-
-                if any(file_path.endswith(ext) for ext in SUPPORTED_IMAGE_FORMATS):
-                    prompt = "write a short one-sentence description for the image"
-                    file_obj = self.upload_img(file_path)
-                elif any(file_path.endswith(ext) for ext in SUPPORTED_VIDEO_FORMATS):
-                    prompt = "write a short one-paragraph description for the video, depending on its duration."
-                    file_obj = self.upload_vid(file_path)
-
-                log.info(f"Generating description for {file_name}")
-                response = self.desc_model.generate_content([file_obj, prompt])
-                genai.delete_file(file_obj.name)
-
-                media_data.append({"source": file_path, "desc": response.text})
+            self.report_progress("Analysing user media files")
+            media_data = self.describe_all_media()
 
             video_prompt = f"""title: {self.title} description: {self.desc} style: {self.style} duration: {self.duration}"""
             if self.user_has_provided_media:
                 video_prompt += f"Media clips and AI descriptions: {media_data}"
 
-            response = self.video_model.generate_content(video_prompt)
-            script = self.format_json(raw=response.text)
-
+            self.report_progress("Generating script and rendering scenes..")
+            script, segment_paths = self.generate_script(video_prompt)
             log.info(f"video script \n {script}")
-            log.info("Retrieving pexel footage and media bucket links..")
-            for clip in script["scenes"]:
-                source, form = clip["type"].split("_")
-                if source == "stock":
-
-                    if form == "video":
-                        response = self.query_pexel(
-                            self.VID_PREF + quote(clip["query"])
-                        )
-                        for video in response["videos"][0]["video_files"]:
-                            if video["quality"] == "hd":
-                                media_url = video["link"]
-                                break
-                        clip["media_url"] = media_url
-                        file_path = download_media(
-                            media_url, user_media_path=self.user_media_path
-                        )
-
-                    elif form == "photo":
-                        response = self.query_pexel(
-                            self.IMG_PREF + quote(clip["query"])
-                        )
-                        media_url = response["photos"][0]["src"]["landscape"]
-                        clip["media_url"] = media_url
-                        file_path = download_media(
-                            media_url, user_media_path=self.user_media_path
-                        )
-
-                    clip["media_path"] = file_path
-                    del clip["query"]
-
-                else:
-                    temp_media_path = clip["media_path"]
-                    user_media_unique_name = str(uuid.uuid4())
-                    self.DATABASE_OPERATIONS_SERVICE.upload_file_by_path(
-                        temp_media_path, user_media_unique_name
-                    )
-                    user_media_signed_url = (
-                        self.DATABASE_OPERATIONS_SERVICE.get_file_link(
-                            key=user_media_unique_name
-                        )
-                    )
-                    clip["media_url"] = user_media_signed_url
-
-            log.info("Generating Narration")
-            for clip in script["scenes"]:
-                file_name = os.path.splitext(os.path.basename(clip["media_path"]))[0]
-                text = clip["script"]
-                audio_path = text_to_speech(
-                    text, file_name, user_media_path=self.user_media_path
-                )
-                clip["audio_path"] = audio_path
-
-            log.info("Generating video clips..")
-            mov_clips = []
             for pair in script["scenes"]:
-                form = pair["type"].split("_")[1]
-                if form == "photo":
-                    mov_clip = create_photo_clip(
-                        pair["media_path"], pair["audio_path"], RES
-                    )
-                elif form == "video":
-                    mov_clip = create_video_clip(
-                        pair["media_path"], pair["audio_path"], RES, FPS
-                    )
-
-                if pair["text_overlay"]:
-                    mov_clip = add_text_overlay(mov_clip, pair["text_overlay"])
-
                 del pair["media_path"]
                 del pair["audio_path"]
-
-                # transitions
-                # if i > 0:
-                #     prev_clip = clips[-1]
-                #     transition_type = script["scenes"][i - 1].get("transition", "fade")
-                #     prev_clip, clip = VideoTransitionHelper.apply_transition(
-                #         prev_clip, clip, transition_type
-                #     )
-                #     clips[-1] = prev_clip
-
-                mov_clips.append(mov_clip)
-
-            final_video = concatenate_videoclips(mov_clips, method="compose")
-            final_video_path = os.path.join(self.user_media_path, "final_video.mp4")
-
-            final_video.write_videofile(
-                final_video_path,
-                codec="libx264",
-                audio_codec="aac",
-                fps=FPS,
-                preset="ultrafast",
-                threads=4,
+                del pair["word_timings"]
+            script["outputs"] = [name for name, _ in self.outputs]
+
+            self.report_progress("Rendering final video..")
+            segment_keys = profile_segment_keys(
+                [
+                    [segment_cache_key(path) for path in scene_paths]
+                    for scene_paths in segment_paths
+                ],
+                render_profiles(self.outputs),
             )
-
-            unique_final_video_name = self.unique_folder_id_param + ".mp4"
-            self.DATABASE_OPERATIONS_SERVICE.upload_file_by_path(
-                final_video_path, unique_final_video_name
+            video_paths = join_renditions(
+                segment_paths, self.outputs, self.user_media_path, "final_video"
             )
-            signed_file_url = self.DATABASE_OPERATIONS_SERVICE.get_file_link(
-                key=unique_final_video_name
+
+            # Every rendition uploads together.
+            uploads = [
+                (video_path, rendition_name(self.unique_folder_id_param, index, name))
+                for index, (video_path, (name, _)) in enumerate(
+                    zip(video_paths, self.outputs)
+                )
+            ]
+            signed_urls = self.DATABASE_OPERATIONS_SERVICE.upload_and_link_files(
+                uploads
             )
             shutil.rmtree(self.user_media_path, ignore_errors=True)
 
-            return {"signed_url": signed_file_url, "script": script}
+            return {
+                "signed_url": signed_urls[0],
+                "renditions": dict(zip(script["outputs"], signed_urls)),
+                "script": script,
+                "segment_keys": segment_keys,
+            }
 
 
 class VideoEditor:
     def __init__(
-        self, script: dict, unique_folder_id: str, DATABASE_OPERATIONS_SERVICE: any
+        self,
+        script: dict,
+        unique_folder_id: str,
+        DATABASE_OPERATIONS_SERVICE: any,
+        on_progress=None,
+        segment_keys: list = None,
+        preview: bool = False,
     ):
         self.script = script
+        # segment_keys[i] lists the cached segments (one per output) scene i
+        # can reuse, or is None.
+        self.segment_keys = segment_keys or []
+        self.outputs = parse_outputs(script.get("outputs"))
+        # Previews render at a low resolution and frame rate with a cheaper
+        # encode and plain overlays, for fast iteration before finalizing.
+        self.preview = preview
+        self.resolutions = [
+            preview_resolution(res) if preview else res for _, res in self.outputs
+        ]
+        self.fps = PREVIEW_FPS if preview else FPS
         self.unique_folder_id_param = unique_folder_id
         self.user_media_path = os.path.join("temp", "edit", self.unique_folder_id_param)
         self.DATABASE_OPERATIONS_SERVICE = DATABASE_OPERATIONS_SERVICE
+        self.on_progress = on_progress
 
         if not os.path.exists(os.path.join(self.user_media_path, "media")):
             os.makedirs(os.path.join(self.user_media_path, "media"))
@@ -273,85 +619,267 @@ class VideoEditor:
         if not os.path.exists(os.path.join(self.user_media_path, "audio")):
             os.makedirs(os.path.join(self.user_media_path, "audio"))
 
-    def edit_video(self):
-        log.info("Downloading media files..")
-        for clip in self.script["scenes"]:
-            media_path = download_media(
-                clip["media_url"], user_media_path=self.user_media_path
-            )
-            clip["media_path"] = media_path
-
-        log.info("Generating narration")
-        for clip in self.script["scenes"]:
-            file_name = os.path.splitext(os.path.basename(clip["media_path"]))[0]
-            text = clip["script"]
-            audio_path = text_to_speech(
-                text, file_name, user_media_path=self.user_media_path
+    def report_progress(self, stage: str):
+        log.info(stage)
+        if self.on_progress:
+            self.on_progress(stage)
+
+    def get_subtitle_segments(self):
+        scenes = self.script["scenes"]
+        narration_timings = narration_word_timings(scenes, self.fps)
+        if narration_timings is not None:
+            words, end_time = narration_timings
+        else:
+            # Speech-to-text fallback runs on the narration alone, without music.
+            start_times, duration = scene_timeline(scenes, self.fps)
+            narration_path = mix_timeline(
+                [clip["audio_path"] for clip in scenes],
+                start_times,
+                duration,
+                SAMPLE_RATE,
+                os.path.join(self.user_media_path, "narration.wav"),
             )
-            clip["audio_path"] = audio_path
-
-        log.info("Generating video clips..")
-        mov_clips = []
-        for pair in self.script["scenes"]:
-            form = pair["type"].split("_")[1]
-            if form == "photo":
-                mov_clip = create_photo_clip(
-                    pair["media_path"], pair["audio_path"], RES
-                )
-            elif form == "video":
-                mov_clip = create_video_clip(
-                    pair["media_path"], pair["audio_path"], RES, FPS
+            words, end_time = speech_to_text(narration_path, SAMPLE_RATE), None
+        return get_subtitle_segments(words, end_time=end_time)
+
+    def reuse_segments(self, index: int):
+        if index >= len(self.segment_keys) or self.segment_keys[index] is None:
+            return None
+
+        linked_paths = []
+        for output_index, key in enumerate(self.segment_keys[index]):
+            segment_path = cached_segment(key)
+            if segment_path is None:
+                return None
+            try:
+                # Linked into the edit folder so eviction cannot remove it
+                # mid-edit.
+                linked_paths.append(
+                    link_or_copy(
+                        segment_path,
+                        os.path.join(
+                            self.user_media_path,
+                            "media",
+                            f"segment_{index}_{output_index}.mp4",
+                        ),
+                    )
                 )
+            except FileNotFoundError:
+                return None
+        return linked_paths
+
+    def fetch_scene(self, index: int, clip: dict):
+        segment_paths = self.reuse_segments(index)
+        if segment_paths is not None:
+            clip["segment_paths"] = segment_paths
+            clip["segment_keys"] = self.segment_keys[index]
+            return clip
+        if clip.get("media_key"):
+            # Stored user media URLs have expired by the time a project is
+            # edited, so they are signed again from the bucket key.
+            clip["media_url"] = self.DATABASE_OPERATIONS_SERVICE.get_file_link(
+                key=clip["media_key"]
+            )
+        return download_scene(index, clip, user_media_path=self.user_media_path)
+
+    def narrate_scene(self, index: int, clip: dict):
+        return synthesize_scene_narration(
+            index, clip, user_media_path=self.user_media_path
+        )
 
-            if pair["text_overlay"]:
-                mov_clip = add_text_overlay(mov_clip, pair["text_overlay"])
-
-            # transitions
-            # if i > 0:
-            #     prev_clip = clips[-1]
-            #     transition_type = script["scenes"][i - 1].get("transition", "fade")
-            #     prev_clip, clip = VideoTransitionHelper.apply_transition(
-            #         prev_clip, clip, transition_type
-            #     )
-            #     clips[-1] = prev_clip
-
-            mov_clips.append(mov_clip)
-
-        final_video = concatenate_videoclips(mov_clips, method="compose")
-
-        if self.script["subtitleInput"]:
-            log.info("Generating subtitles..")
-            audio_path = os.path.join(self.user_media_path, "final_audio.wav")
-            audio_clip = final_video.audio
-            audio_clip.fps = SAMPLE_RATE
-            audio_clip.write_audiofile(audio_path)
-
-            transcript = speech_to_text(audio_path, SAMPLE_RATE)
-            subtitles = get_subtitle_clips(transcript)
-            final_video = CompositeVideoClip([final_video] + subtitles)
-
-        if self.script["musicInput"]:
-            log.info("Adding background music..")
-            music_file = os.path.join("music", self.script["music"] + ".mp3")
-            final_video = add_background_music(final_video, music_file)
-
-        final_video_path = os.path.join(self.user_media_path, "final_video.mp4")
-        final_video.write_videofile(
-            final_video_path,
-            codec="libx264",
-            audio_codec="aac",
-            fps=FPS,
-            preset="ultrafast",
-            threads=4,
+    def edit_video(self):
+        self.report_progress("Downloading, narrating and rendering scenes..")
+        with ThreadPoolExecutor(
+            max_workers=DOWNLOAD_WORKERS
+        ) as fetch_pool, ThreadPoolExecutor(max_workers=TTS_WORKERS) as tts_pool:
+            pipeline = ScenePipeline(
+                [
+                    (self.fetch_scene, fetch_pool),
+                    (self.narrate_scene, tts_pool),
+                    scene_render_stage(
+                        self.resolutions, self.fps, preview=self.preview
+                    ),
+                ]
+            )
+            segment_paths = pipeline.run(self.script["scenes"])
+        segment_keys = profile_segment_keys(
+            [
+                clip.get("segment_keys")
+                or [segment_cache_key(path) for path in scene_paths]
+                for clip, scene_paths in zip(self.script["scenes"], segment_paths)
+            ],
+            render_profiles(self.outputs, self.preview),
         )
 
-        unique_final_video_name = self.unique_folder_id_param + ".mp4"
-        self.DATABASE_OPERATIONS_SERVICE.upload_file_by_path(
-            final_video_path, unique_final_video_name
+        self.report_progress("Rendering final video..")
+        concat_video_paths = join_renditions(
+            segment_paths, self.outputs, self.user_media_path, "concat_video"
         )
-        signed_file_url = self.DATABASE_OPERATIONS_SERVICE.get_file_link(
-            key=unique_final_video_name
+        final_video_paths = [
+            os.path.join(self.user_media_path, f"final_video_{output_tag(name)}.mp4")
+            for name, _ in self.outputs
+        ]
+
+        # Without music the narration already in the segments is stream-copied.
+        # With music, narration and music are mixed once and shared by every
+        # rendition.
+        mixed_audio_path = None
+        if self.script.get("musicInput"):
+            self.report_progress("Adding background music..")
+            start_times, duration = scene_timeline(self.script["scenes"], self.fps)
+            mixed_audio_path = mix_timeline(
+                [clip["audio_path"] for clip in self.script["scenes"]],
+                start_times,
+                duration,
+                SAMPLE_RATE,
+                os.path.join(self.user_media_path, "mixed_audio.wav"),
+                music_file=os.path.join("music", self.script["music"] + ".mp3"),
+                ducking=self.script.get("musicDucking", MUSIC_DUCKING),
+            )
+        subtitle_paths = {}
+        subtitle_segments = None
+        # Previews never re-encode the timeline to burn subtitles in.
+        subtitle_mode = "soft" if self.preview else self.script.get(
+            "subtitleMode", SUBTITLE_MODE
         )
+
+        if self.script.get("subtitleInput"):
+            self.report_progress("Generating subtitles..")
+            subtitle_segments = self.get_subtitle_segments()
+            if subtitle_mode == "soft":
+                subtitle_paths = {
+                    "srt": write_srt(
+                        subtitle_segments,
+                        os.path.join(self.user_media_path, "subtitles.srt"),
+                    ),
+                    "vtt": write_webvtt(
+                        subtitle_segments,
+                        os.path.join(self.user_media_path, "subtitles.vtt"),
+                    ),
+                }
+
+        for concat_video_path, final_video_path in zip(
+            concat_video_paths, final_video_paths
+        ):
+            if subtitle_segments is None or subtitle_mode == "soft":
+                remux_video(
+                    concat_video_path,
+                    final_video_path,
+                    audio_path=mixed_audio_path,
+                    subtitle_path=subtitle_paths.get("srt"),
+                )
+            elif RENDER_BACKEND == "ffmpeg":
+                # Burned-in subtitles span scene boundaries, so this path still
+                # re-encodes the joined timeline.
+                ffmpeg_backend.burn_subtitles(
+                    concat_video_path,
+                    subtitle_segments,
+                    final_video_path,
+                    self.fps,
+                    audio_path=mixed_audio_path,
+                )
+            else:
+                # The burned-in video is written silent and the audio muxed
+                # back in, so the segment audio is never decoded.
+                silent_video_path = final_video_path + ".video.mp4"
+                final_video = VideoFileClip(concat_video_path, audio=False)
+                subtitles = get_subtitle_clips(subtitle_segments)
+                final_video = CompositeVideoClip([final_video] + subtitles)
+                write_video(final_video, silent_video_path, self.fps)
+                remux_video(
+                    silent_video_path,
+                    final_video_path,
+                    audio_path=mixed_audio_path or concat_video_path,
+                    audio_codec=AUDIO_CODEC if mixed_audio_path else "copy",
+                )
+
+        # Every rendition and its subtitle files upload together.
+        uploads = [
+            (final_video_path, rendition_name(self.unique_folder_id_param, index, name))
+            for index, (final_video_path, (name, _)) in enumerate(
+                zip(final_video_paths, self.outputs)
+            )
+        ] + [
+            (subtitle_path, f"{self.unique_folder_id_param}.{subtitle_format}")
+            for subtitle_format, subtitle_path in subtitle_paths.items()
+        ]
+        signed_urls = self.DATABASE_OPERATIONS_SERVICE.upload_and_link_files(uploads)
         shutil.rmtree(self.user_media_path, ignore_errors=True)
 
-        return {"signed_url": signed_file_url}
+        video_urls = signed_urls[: len(self.outputs)]
+        subtitle_urls = dict(zip(subtitle_paths, signed_urls[len(self.outputs) :]))
+        return {
+            "signed_url": video_urls[0],
+            "renditions": dict(zip((name for name, _ in self.outputs), video_urls)),
+            "subtitle_urls": subtitle_urls or None,
+            "segment_keys": segment_keys,
+        }
+
+
+# Entry points for the render pool (utils.render_jobs). They run in spawned
+# worker processes, so they build their own DatabaseOperations service.
+def render_generated_video(user_video_options: dict, on_progress=None):
+    database_operations = DatabaseOperations()
+    content_creator = ContentCreator(
+        user_video_options=user_video_options,
+        DATABASE_OPERATIONS_SERVICE=database_operations,
+        on_progress=on_progress,
+    )
+    response = content_creator.start_script_generation()
+    if response is None:
+        return None
+
+    # The request folder id doubles as the project id for later edits.
+    project_id = user_video_options["user_media_path"]
+    save_project(
+        database_operations,
+        project_id,
+        response["script"],
+        response.pop("segment_keys"),
+        script=response["script"],
+    )
+    response["project_id"] = project_id
+    return response
+
+
+def validate_edit_request(request_body: dict):
+    # Run by the API before an edit is queued, so a missing project, a bad
+    # patch or unsupported outputs fail the request instead of the job.
+    _, _, script, _ = resolve_edit_request(DatabaseOperations(), request_body)
+    parse_outputs(script.get("outputs"))
+
+
+def render_edited_video(request_body: dict, unique_folder_id: str, on_progress=None):
+    # Accepts a full script or a patch against a stored project
+    # (utils/project_store.py). "preview": true renders a draft.
+    database_operations = DatabaseOperations()
+    project_id, project, script, changed_scenes = resolve_edit_request(
+        database_operations, request_body
+    )
+    preview = bool(request_body.get("preview"))
+    profiles = render_profiles(parse_outputs(script.get("outputs")), preview)
+    stored_script = copy.deepcopy(script)
+
+    video_editor = VideoEditor(
+        script=script,
+        unique_folder_id=unique_folder_id,
+        DATABASE_OPERATIONS_SERVICE=database_operations,
+        on_progress=on_progress,
+        segment_keys=reusable_segment_keys(project, script, changed_scenes, profiles),
+        preview=preview,
+    )
+    response = video_editor.edit_video()
+
+    segment_keys = response.pop("segment_keys")
+    if project_id is not None:
+        is_patch = "changes" in request_body or "scenes" in request_body
+        save_project(
+            database_operations,
+            project_id,
+            stored_script,
+            segment_keys,
+            script=stored_script if is_patch else None,
+        )
+        response["project_id"] = project_id
+    response["preview"] = preview
+    return response
@@ -2,78 +2,206 @@ from fastapi.responses import Response
 from fastapi import Request
 from starlette.datastructures import UploadFile
 import os
+import shutil
+import asyncio
+import hashlib
 import aiofiles
 import uuid
 import logging as log
-from utils.database_operations import DatabaseOperations
-from content_creator import ContentCreator, VideoEditor
+from utils.render_jobs import RenderJobManager
+from content_creator import (
+    render_generated_video,
+    render_edited_video,
+    validate_edit_request,
+    parse_outputs,
+)
+from utils.project_store import ProjectNotFoundError
 
 
-DATABASE_OPERATIONS_SERVICE = DatabaseOperations()
+RENDER_JOBS = RenderJobManager()
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 500 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+def limit_request_body(request: Request, max_bytes: int):
+    # Counts body bytes as the client sends them, so an oversized upload is
+    # rejected mid-stream instead of after the form parser has spooled it.
+    received_bytes = 0
+
+    async def receive():
+        nonlocal received_bytes
+        message = await request.receive()
+        if message["type"] == "http.request":
+            received_bytes += len(message.get("body", b""))
+            if received_bytes > max_bytes:
+                raise UploadTooLargeError(
+                    f"Uploaded media exceeds the {max_bytes} byte limit"
+                )
+        return message
+
+    return Request(request.scope, receive)
 
 
 class ApiController:
 
     async def generate_video(self, request: Request, response: Response):
         # try:
-            request_formdata = await request.form()
-            unique_folder_name = str(uuid.uuid4())
-            user_provided_media = False
-            number_of_media_files = 0
-            file_names = []
-
-            formdata_dict = {}
-            media_files = []
-
-            for key, value in request_formdata.multi_items():
-                if key == "media":
-                    media_files.append(value)
-                else:
-                    formdata_dict[key] = value
-
-            formdata_dict["media"] = media_files
-
-            for key, value in formdata_dict.items():
-                if key == "media":
-                    for media in value:
-                        if isinstance(media, UploadFile):
-                            file: UploadFile = media
-                            if self.is_valid_file(file):
-                                number_of_media_files += 1
-                                file_names.append(file.filename)
-                                await self.process_file(
-                                    file=file, unique_folder_name=unique_folder_name
-                                )
-
-            if number_of_media_files > 0:
-                user_provided_media = True
-
-            user_video_options = {
-                "title": formdata_dict.get("title"),
-                "description": formdata_dict.get("description"),
-                "template": formdata_dict.get("template"),
-                "duration": formdata_dict.get("duration"),
-                "use_stock_media": self.string_to_bool(
-                    formdata_dict.get("use_stock_media")
-                ),
-                "user_has_provided_media": user_provided_media,
-                "user_media_path": unique_folder_name,
-                "uploaded_files_names": file_names,
-            }
-
-            log.info(f"user input: {user_video_options}")
-            content_creator = ContentCreator(
-                user_video_options=user_video_options,
-                DATABASE_OPERATIONS_SERVICE=DATABASE_OPERATIONS_SERVICE,
-            )
-            response = content_creator.start_script_generation()
+            try:
+                user_video_options = await self.parse_generate_request(request)
+            except UploadTooLargeError as e:
+                response.status_code = 413
+                return {"status": "error", "message": str(e)}
+            except ValueError as e:
+                response.status_code = 400
+                return {"status": "error", "message": str(e)}
+            response = await RENDER_JOBS.run(render_generated_video, user_video_options)
 
         # except Exception as e:
         #     log.error(f"Error processing request: {e}")
         #     response.status_code = 500
         #     return {"status": "error", "message": "Internal server error"}
 
-            return {"script": response["script"], "signed_url": response["signed_url"]}
+            return {
+                "script": response["script"],
+                "signed_url": response["signed_url"],
+                "renditions": response["renditions"],
+                "project_id": response["project_id"],
+            }
+
+    async def submit_generate_video(self, request: Request, response: Response):
+        try:
+            user_video_options = await self.parse_generate_request(request)
+        except UploadTooLargeError as e:
+            response.status_code = 413
+            return {"status": "error", "message": str(e)}
+        except ValueError as e:
+            response.status_code = 400
+            return {"status": "error", "message": str(e)}
+        job_id = RENDER_JOBS.submit(render_generated_video, user_video_options)
+        response.status_code = 202
+        return {"job_id": job_id}
+
+    async def submit_edit_video(self, request: Request, response: Response):
+        request_body = await request.json()
+        error = await self.check_edit_request(request_body, response)
+        if error is not None:
+            return error
+        unique_folder_name = str(uuid.uuid4())
+        job_id = RENDER_JOBS.submit(
+            render_edited_video, request_body, unique_folder_name
+        )
+        response.status_code = 202
+        # "finalize": true on a preview queues the full-quality render to
+        # start once the preview job is done.
+        if request_body.get("preview") and request_body.get("finalize"):
+            return {
+                "job_id": job_id,
+                "finalize_job_id": self.submit_finalize(
+                    request_body.get("project_id"), request_body, after=job_id
+                ),
+            }
+        return {"job_id": job_id}
+
+    async def check_edit_request(self, request_body, response: Response):
+        try:
+            await asyncio.to_thread(validate_edit_request, request_body)
+        except ProjectNotFoundError as e:
+            response.status_code = 404
+            return {"status": "error", "message": str(e)}
+        except ValueError as e:
+            response.status_code = 400
+            return {"status": "error", "message": str(e)}
+        return None
+
+    def get_job(self, job_id: str, response: Response):
+        job = RENDER_JOBS.get(job_id)
+        if job is None:
+            response.status_code = 404
+            return {"status": "error", "message": "Job not found"}
+        return job
+
+    def shutdown(self):
+        RENDER_JOBS.shutdown()
+
+    async def parse_generate_request(self, request: Request):
+        content_length = int(request.headers.get("content-length") or 0)
+        if content_length > UPLOAD_MAX_BYTES:
+            raise UploadTooLargeError(
+                f"Uploaded media exceeds the {UPLOAD_MAX_BYTES} byte limit"
+            )
+
+        request_formdata = await limit_request_body(request, UPLOAD_MAX_BYTES).form()
+        unique_folder_name = str(uuid.uuid4())
+        user_provided_media = False
+        number_of_media_files = 0
+        file_names = []
+        valid_files = []
+
+        formdata_dict = {}
+        media_files = []
+
+        for key, value in request_formdata.multi_items():
+            if key == "media":
+                media_files.append(value)
+            else:
+                formdata_dict[key] = value
+
+        formdata_dict["media"] = media_files
+        # Checked before any upload is written to disk.
+        parse_outputs(formdata_dict.get("outputs"))
+
+        for key, value in formdata_dict.items():
+            if key == "media":
+                for media in value:
+                    if isinstance(media, UploadFile):
+                        file: UploadFile = media
+                        if self.is_valid_file(file):
+                            number_of_media_files += 1
+                            file_names.append(os.path.basename(file.filename))
+                            valid_files.append(file)
+
+        # Every copy finishes before a failure is handled, so the folder is
+        # never removed while a sibling task is still writing into it.
+        results = await asyncio.gather(
+            *(
+                self.process_file(file=file, unique_folder_name=unique_folder_name)
+                for file in valid_files
+            ),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            shutil.rmtree(
+                os.path.join("temp", "new", unique_folder_name), ignore_errors=True
+            )
+            raise errors[0]
+        file_hashes = results
+
+        if number_of_media_files > 0:
+            user_provided_media = True
+
+        user_video_options = {
+            "title": formdata_dict.get("title"),
+            "description": formdata_dict.get("description"),
+            "template": formdata_dict.get("template"),
+            "duration": formdata_dict.get("duration"),
+            "use_stock_media": self.string_to_bool(
+                formdata_dict.get("use_stock_media")
+            ),
+            "user_has_provided_media": user_provided_media,
+            "user_media_path": unique_folder_name,
+            "uploaded_files_names": file_names,
+            "uploaded_files_hashes": dict(zip(file_names, file_hashes)),
+            # Comma-separated aspect ratios or WXH sizes, e.g. "16:9,9:16,1:1".
+            "outputs": formdata_dict.get("outputs"),
+        }
+
+        log.info(f"user input: {user_video_options}")
+        return user_video_options
 
     def is_valid_file(self, file: UploadFile):
         if file.size > 0:
@@ -82,13 +210,19 @@ class ApiController:
 
     async def process_file(self, file: UploadFile, unique_folder_name: str):
         log.info(f"Processing file: {file.filename}, size: {file.size}")
-        save_directory = os.path.join("temp", unique_folder_name, "media")
+        save_directory = os.path.join("temp", "new", unique_folder_name, "media")
         os.makedirs(save_directory, exist_ok=True)
-        file_path = os.path.join(save_directory, file.filename)
+        file_path = os.path.join(save_directory, os.path.basename(file.filename))
 
+        # Copies the spooled upload in fixed-size chunks so at most one chunk
+        # per file is held in memory, hashing it on the way.
+        digest = hashlib.sha256()
         async with aiofiles.open(file_path, "wb") as out_file:
-            content = await file.read()
-            await out_file.write(content)
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                await out_file.write(chunk)
+
+        return digest.hexdigest()
 
     def string_to_bool(self, string: str):
         try:
@@ -101,17 +235,62 @@ class ApiController:
 
     async def edit_video(self, request: Request, response: Response):
         # try:
+            # The body is either a full script or a patch against a stored
+            # project: {"project_id", "changes", "scenes": {index: fields}}.
             request_body = await request.json()
+            error = await self.check_edit_request(request_body, response)
+            if error is not None:
+                return error
             unique_folder_name = str(uuid.uuid4())
-            video_editor = VideoEditor(
-                unique_folder_id=unique_folder_name,
-                script=request_body,
-                DATABASE_OPERATIONS_SERVICE=DATABASE_OPERATIONS_SERVICE,
-            )
-            response = video_editor.edit_video()
+            try:
+                result = await RENDER_JOBS.run(
+                    render_edited_video, request_body, unique_folder_name
+                )
+            except ProjectNotFoundError as e:
+                response.status_code = 404
+                return {"status": "error", "message": str(e)}
         # except Exception as e:
         #     log.error(f"Error processing request: {e}")
         #     response.status_code = 500
         #     return {"status": "error", "message": "Internal server error"}
 
-            return {"signed_url": response["signed_url"]}
+            edit_response = {
+                "signed_url": result["signed_url"],
+                "renditions": result["renditions"],
+                "subtitle_urls": result["subtitle_urls"],
+                "project_id": result.get("project_id"),
+                "preview": result["preview"],
+            }
+            # "finalize": true on a preview queues the full-quality render
+            # once the preview is delivered.
+            if result["preview"] and request_body.get("finalize"):
+                edit_response["finalize_job_id"] = self.submit_finalize(
+                    result.get("project_id"), request_body
+                )
+            return edit_response
+
+    def submit_finalize(
+        self, project_id: str, request_body: dict = None, after: str = None
+    ):
+        # Projects already hold the previewed script, so finalizing renders
+        # the stored script. Full-script previews are re-rendered as final.
+        # after is the preview job that must finish (and save) first.
+        if project_id is not None:
+            finalize_body = {"project_id": project_id}
+        else:
+            finalize_body = {**request_body, "preview": False, "finalize": False}
+        if after is not None:
+            return RENDER_JOBS.submit_after(
+                after, render_edited_video, finalize_body, str(uuid.uuid4())
+            )
+        return RENDER_JOBS.submit(
+            render_edited_video, finalize_body, str(uuid.uuid4())
+        )
+
+    async def finalize_project(self, project_id: str, response: Response):
+        error = await self.check_edit_request({"project_id": project_id}, response)
+        if error is not None:
+            return error
+        job_id = self.submit_finalize(project_id)
+        response.status_code = 202
+        return {"job_id": job_id}
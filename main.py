@@ -52,3 +52,48 @@ async def generate_video(request: Request, response: Response):
 )
 async def edit_video(request: Request, response: Response):
     return await API_CONTROLLER.edit_video(request=request, response=response)
+
+
+@app.post(
+    "/v1/jobs/generate-video",
+    status_code=202,
+    summary="Queue an AI generated video render and return its job id",
+)
+async def submit_generate_video(request: Request, response: Response):
+    return await API_CONTROLLER.submit_generate_video(
+        request=request, response=response
+    )
+
+
+@app.post(
+    "/v1/jobs/edit-video",
+    status_code=202,
+    summary="Queue an edit render for the AI generated video and return its job id",
+)
+async def submit_edit_video(request: Request, response: Response):
+    return await API_CONTROLLER.submit_edit_video(request=request, response=response)
+
+
+@app.post(
+    "/v1/projects/{project_id}/finalize",
+    status_code=202,
+    summary="Queue the full-quality render of a previewed project",
+)
+async def finalize_project(project_id: str, response: Response):
+    return await API_CONTROLLER.finalize_project(
+        project_id=project_id, response=response
+    )
+
+
+@app.get(
+    "/v1/jobs/{job_id}",
+    status_code=200,
+    summary="Get the status, progress and result of a render job",
+)
+def get_job(job_id: str, response: Response):
+    return API_CONTROLLER.get_job(job_id=job_id, response=response)
+
+
+@app.on_event("shutdown")
+def shutdown():
+    API_CONTROLLER.shutdown()
@@ -0,0 +1,146 @@
+import io
+import os
+import re
+import sys
+import copy
+import json
+import types
+import wave
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Caches are created on import, so they are pointed at a scratch directory
+# before any module under test is loaded.
+os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="clip-craft-cache-")
+
+
+class DatabaseOperations:
+    # In-memory stand-in for utils.database_operations, which connects to
+    # Firebase on import. State is shared between instances like the real
+    # Firestore and bucket.
+    documents = {}
+    files = {}
+
+    def upload_file_by_path(self, file_path, file_name, content_hash=None):
+        with open(file_path, "rb") as file:
+            self.files[file_name] = file.read()
+
+    def upload_and_link_files(self, uploads):
+        for file_path, file_name in uploads:
+            self.upload_file_by_path(file_path, file_name)
+        return [self.get_file_link(file_name) for _, file_name in uploads]
+
+    def get_file_link(self, key, expiration=60):
+        return f"https://storage.example.com/{key}"
+
+    def create_document(self, collection_name, document_id, data):
+        self.documents[(collection_name, document_id)] = copy.deepcopy(data)
+
+    def get_document(self, collection_name, document_id):
+        return copy.deepcopy(self.documents.get((collection_name, document_id)))
+
+
+database_operations = types.ModuleType("utils.database_operations")
+database_operations.DatabaseOperations = DatabaseOperations
+sys.modules["utils.database_operations"] = database_operations
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(os.environ["CACHE_DIR"], ignore_errors=True)
+
+
+def silent_wav(seconds, sample_rate=24000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(sample_rate)
+        audio.writeframes(b"\0\0" * int(seconds * sample_rate))
+    return buffer.getvalue()
+
+
+class FakeTextToSpeechClient:
+    def synthesize_speech(self, input, voice, audio_config, enable_time_pointing=None):
+        # Narration lasts 0.1s per word, so different text gives different audio.
+        marks = re.findall(r'<mark name="(\d+)"/>', input.ssml or "")
+        words = len(marks) or len((input.text or "").split())
+        return SimpleNamespace(
+            audio_content=silent_wav(0.1 * words),
+            timepoints=[
+                SimpleNamespace(mark_name=mark, time_seconds=0.05 * index)
+                for index, mark in enumerate(marks)
+            ],
+        )
+
+
+def fake_stream_to_file(media_url, file_path):
+    from PIL import Image
+
+    color = tuple(sum(map(ord, media_url)) * (index + 1) % 256 for index in range(3))
+    Image.new("RGB", (320, 180), color).save(file_path, format="PNG")
+
+
+class FakeGenerativeModel:
+    script = None
+
+    def __init__(self, model_name, system_instruction=None):
+        self.model_name = model_name
+
+    def generate_content(self, contents, stream=False, request_options=None):
+        raw = json.dumps(self.script)
+        # Streamed in small chunks so scenes arrive across several of them.
+        return [
+            SimpleNamespace(text=raw[start : start + 40])
+            for start in range(0, len(raw), 40)
+        ]
+
+
+@pytest.fixture
+def studio(tmp_path, monkeypatch):
+    # Runs the real render path on a scratch working directory. Only network
+    # services are faked: Firebase, Gemini, Pexels and text-to-speech.
+    for name in ("config", "constants", "fonts", "music"):
+        os.symlink(os.path.join(ROOT, name), tmp_path / name)
+    monkeypatch.chdir(tmp_path)
+
+    import content_creator
+    import utils.render_cache
+    import utils.video_helpers
+    from utils.disk_cache import hash_key
+
+    DatabaseOperations.documents = {}
+    DatabaseOperations.files = {}
+    monkeypatch.setattr(content_creator.genai, "GenerativeModel", FakeGenerativeModel)
+    monkeypatch.setattr(
+        content_creator.ContentCreator,
+        "query_pexel",
+        lambda self, url: {
+            "photos": [
+                {
+                    "width": 320,
+                    "height": 180,
+                    "src": {
+                        "original": f"https://images.example.com/{hash_key(url)}.png"
+                    },
+                }
+            ]
+        },
+    )
+    monkeypatch.setattr(utils.video_helpers, "stream_to_file", fake_stream_to_file)
+    monkeypatch.setattr(
+        utils.video_helpers, "get_tts_client", lambda: FakeTextToSpeechClient()
+    )
+    # Segments render on threads so the patches above apply to them.
+    segment_pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(utils.render_cache, "get_segment_pool", lambda: segment_pool)
+
+    yield SimpleNamespace(
+        module=content_creator, database=DatabaseOperations, model=FakeGenerativeModel
+    )
+    segment_pool.shutdown(wait=True)
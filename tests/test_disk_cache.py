@@ -0,0 +1,34 @@
+import os
+
+import utils.disk_cache
+from utils.disk_cache import DiskCache
+
+
+def test_puts_evict_least_recently_used_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.disk_cache, "CACHE_DIR", str(tmp_path))
+    cache = DiskCache("entries", max_bytes=250)
+
+    first = cache.put_bytes("aa01", b"x" * 100)
+    os.utime(first, (1, 1))
+    cache.put_bytes("bb02", b"x" * 100)
+    cache.put_bytes("cc03", b"x" * 100)
+
+    assert cache.get("aa01") is None
+    assert cache.get("bb02") is not None
+    assert cache.get("cc03") is not None
+
+
+def test_puts_do_not_rescan_the_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.disk_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(utils.disk_cache, "CACHE_RESCAN_COMMITS", 64)
+    cache = DiskCache("entries", max_bytes=1024 * 1024)
+    walks = []
+    walk = os.walk
+    monkeypatch.setattr(
+        utils.disk_cache.os, "walk", lambda path: walks.append(path) or walk(path)
+    )
+
+    for index in range(10):
+        cache.put_bytes(f"{index:04}", b"x" * 100)
+
+    assert len(walks) == 1
@@ -0,0 +1,33 @@
+import pytest
+
+from content_creator import parse_outputs, preview_resolution
+
+
+def test_outputs_accept_names_and_sizes():
+    assert parse_outputs("9:16, 640x360") == [
+        ("9:16", (720, 1280)),
+        ("640x360", (640, 360)),
+    ]
+    assert parse_outputs(None) == [("16:9", (1280, 720))]
+
+
+@pytest.mark.parametrize(
+    "outputs",
+    [
+        "0x0",
+        "-4x10",
+        "1x1",
+        "641x360",
+        "100000x100000",
+        "21:9",
+        ["9:16", 5],
+        {"9:16": True},
+    ],
+)
+def test_invalid_outputs_are_rejected(outputs):
+    with pytest.raises(ValueError):
+        parse_outputs(outputs)
+
+
+def test_previews_of_tiny_outputs_keep_a_frame():
+    assert preview_resolution((2, 2)) == (2, 2)
@@ -0,0 +1,149 @@
+import pytest
+
+import utils.video_helpers
+from utils.project_store import PROJECT_COLLECTION, apply_script_patch
+
+SCRIPT = {
+    "music": "cinematic",
+    "scenes": [
+        {
+            "type": "stock_photo",
+            "query": "sunset over mountains",
+            "script": "The sun sets over the mountains.",
+            "text_overlay": {"content": "Sunset", "font": "TAHOMA"},
+            "transition": "crossfade",
+        },
+        {
+            "type": "stock_photo",
+            "query": "rainbow on the ocean",
+            "script": "A rainbow rises over the ocean.",
+            "text_overlay": None,
+            "transition": "fade-to-black",
+        },
+    ],
+}
+
+
+@pytest.fixture
+def project(studio):
+    studio.model.script = SCRIPT
+    response = studio.module.render_generated_video(
+        {
+            "title": "Landscapes",
+            "description": "Two calm scenes",
+            "template": "documentary",
+            "duration": "10",
+            "use_stock_media": True,
+            "user_has_provided_media": False,
+            "user_media_path": "project-1",
+            "uploaded_files_names": [],
+            "uploaded_files_hashes": {},
+            "outputs": "16:9",
+        }
+    )
+    assert response["signed_url"].endswith("/project-1.mp4")
+    return response["project_id"]
+
+
+def stored_keys(studio, project_id):
+    project = studio.database.documents[(PROJECT_COLLECTION, project_id)]
+    return [entry["key"] for entry in project["segments"]["final_16x9"]]
+
+
+def test_patch_edit_reuses_unchanged_scenes(studio, project, monkeypatch):
+    generated_keys = stored_keys(studio, project)
+    fetched = []
+    download_scene = studio.module.download_scene
+
+    def record_download(index, clip, user_media_path):
+        fetched.append(index)
+        return download_scene(index, clip, user_media_path=user_media_path)
+
+    monkeypatch.setattr(studio.module, "download_scene", record_download)
+    response = studio.module.render_edited_video(
+        {"project_id": project, "scenes": {"1": {"script": "A storm rolls in."}}},
+        "edit-1",
+    )
+
+    assert fetched == [1]
+    assert response["signed_url"].endswith("/edit-1.mp4")
+    edited_keys = stored_keys(studio, project)
+    assert edited_keys[0] == generated_keys[0]
+    assert edited_keys[1] != generated_keys[1]
+    stored_script = studio.database.documents[(PROJECT_COLLECTION, project)]["script"]
+    assert stored_script["scenes"][1]["script"] == "A storm rolls in."
+
+
+def test_finalize_renders_the_generated_project(studio, project):
+    generated_keys = stored_keys(studio, project)
+
+    response = studio.module.render_edited_video({"project_id": project}, "final-1")
+
+    assert response["project_id"] == project
+    assert response["preview"] is False
+    assert "final-1.mp4" in studio.database.files
+    assert stored_keys(studio, project) == generated_keys
+
+
+def test_edits_sign_user_media_again(studio, monkeypatch):
+    media_key = f"media/{'a' * 64}.png"
+    studio.database.documents[(PROJECT_COLLECTION, "project-2")] = {
+        "script": {
+            "outputs": ["16:9"],
+            "scenes": [
+                {
+                    "type": "user_photo",
+                    "media_url": f"https://storage.example.com/{media_key}?Expires=1",
+                    "media_key": media_key,
+                    "script": "A photo from the trip.",
+                    "text_overlay": None,
+                }
+            ],
+        },
+        "segments": {},
+    }
+    downloaded = []
+    stream_to_file = utils.video_helpers.stream_to_file
+
+    def record_stream(media_url, file_path):
+        downloaded.append(media_url)
+        return stream_to_file(media_url, file_path)
+
+    monkeypatch.setattr(utils.video_helpers, "stream_to_file", record_stream)
+    studio.module.render_edited_video(
+        {"project_id": "project-2", "scenes": {"0": {"script": "Back home."}}},
+        "edit-2",
+    )
+
+    assert downloaded == [f"https://storage.example.com/{media_key}"]
+
+
+def test_new_media_drops_the_stored_media_key():
+    script = {"scenes": [{"type": "user_photo", "media_key": "media/old.png"}]}
+
+    patched, _ = apply_script_patch(
+        script, {"scenes": {"0": {"media_url": "https://example.com/new.png"}}}
+    )
+
+    assert "media_key" not in patched["scenes"][0]
+
+
+@pytest.mark.parametrize(
+    "patch",
+    [
+        {"scenes": {"-1": {"script": "Before the first scene."}}},
+        {"scenes": {"3": {"script": "Past the end."}}},
+        {"scenes": {"0": "not a scene"}},
+        {"changes": ["musicInput"]},
+    ],
+)
+def test_invalid_patches_are_rejected(patch):
+    with pytest.raises(ValueError):
+        apply_script_patch(SCRIPT, patch)
+
+
+def test_edit_requests_are_validated_before_rendering(studio, project):
+    with pytest.raises(ValueError):
+        studio.module.validate_edit_request(
+            {"project_id": project, "changes": {"outputs": ["21:9"]}}
+        )
@@ -0,0 +1,67 @@
+import pytest
+from imageio_ffmpeg import count_frames_and_secs
+from moviepy.editor import VideoFileClip
+from PIL import Image
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+import utils.render_cache
+from utils.video_helpers import frame_count, run_ffmpeg
+from conftest import silent_wav
+
+
+@pytest.fixture
+def scene(tmp_path):
+    # 16:9 source whose middle third is green and outer thirds red, so any
+    # squashing into a portrait output shows red at the edges.
+    video_path = str(tmp_path / "source.mp4")
+    run_ffmpeg(
+        [
+            "-f", "lavfi", "-i", "color=red:s=320x180:r=12:d=1",
+            "-vf", "drawbox=x=107:y=0:w=106:h=180:color=green:t=fill",
+            "-pix_fmt", "yuv420p",
+            video_path,
+        ]
+    )
+    audio_path = tmp_path / "narration.wav"
+    audio_path.write_bytes(silent_wav(0.5))
+    return {
+        "type": "stock_video",
+        "media_path": video_path,
+        "audio_path": str(audio_path),
+        "text_overlay": None,
+    }
+
+
+@pytest.mark.parametrize("backend", ["moviepy", "ffmpeg"])
+def test_single_portrait_output_is_cropped(scene, backend, monkeypatch):
+    monkeypatch.setattr(utils.render_cache, "RENDER_BACKEND", backend)
+
+    [segment_path] = utils.render_cache.render_scene_segments(scene, [(72, 128)], 12)
+
+    clip = VideoFileClip(segment_path)
+    try:
+        frame = clip.get_frame(0)
+    finally:
+        clip.close()
+    assert frame.shape[:2] == (128, 72)
+    for column in (2, 36, 69):
+        red, green, _ = frame[64, column]
+        assert green > 100 and red < 100
+
+
+@pytest.mark.parametrize("backend", ["moviepy", "ffmpeg"])
+def test_segments_round_narration_up_to_whole_frames(
+    scene, backend, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(utils.render_cache, "RENDER_BACKEND", backend)
+    photo_path = tmp_path / "photo.png"
+    Image.new("RGB", (64, 36), (0, 200, 0)).save(photo_path)
+    scene.update(type="stock_photo", media_path=str(photo_path))
+    with open(scene["audio_path"], "wb") as audio:
+        audio.write(silent_wav(0.71))
+
+    [segment_path] = utils.render_cache.render_scene_segments(scene, [(64, 36)], 24)
+
+    frames, _ = count_frames_and_secs(segment_path)
+    assert frames == frame_count(0.71, 24) == 18
+    assert ffmpeg_parse_infos(segment_path)["duration"] == pytest.approx(0.75, abs=0.01)
@@ -0,0 +1,50 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.render_jobs import RenderJobManager
+
+
+@pytest.fixture
+def jobs():
+    manager = RenderJobManager()
+    manager.executor = ThreadPoolExecutor(max_workers=2)
+    manager.progress = {}
+    yield manager
+    manager.executor.shutdown()
+
+
+def test_chained_job_starts_after_its_parent(jobs):
+    released = threading.Event()
+    order = []
+
+    def preview(on_progress):
+        released.wait(5)
+        order.append("preview")
+
+    def finalize(on_progress):
+        order.append("finalize")
+        return "final"
+
+    parent_id = jobs.submit(preview)
+    job_id = jobs.submit_after(parent_id, finalize)
+    assert jobs.get(job_id)["status"] == "queued"
+    assert jobs.get(job_id)["stage"] == "waiting"
+
+    released.set()
+    assert jobs.jobs[job_id]["future"].result(timeout=5) == "final"
+    assert order == ["preview", "finalize"]
+    assert jobs.get(job_id)["status"] == "done"
+
+
+def test_chained_job_fails_with_its_parent(jobs):
+    def preview(on_progress):
+        raise ValueError("bad scene")
+
+    parent_id = jobs.submit(preview)
+    job_id = jobs.submit_after(parent_id, lambda on_progress: "final")
+
+    with pytest.raises(RuntimeError):
+        jobs.jobs[job_id]["future"].result(timeout=5)
+    assert jobs.get(job_id)["status"] == "failed"
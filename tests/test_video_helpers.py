@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+import utils.video_helpers
+from utils.video_helpers import fit_frame, remux_video, run_ffmpeg, scene_video_proxy
+from conftest import FakeTextToSpeechClient, silent_wav
+
+
+def test_evicted_narration_is_synthesized_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        utils.video_helpers, "get_tts_client", lambda: FakeTextToSpeechClient()
+    )
+    os.makedirs(tmp_path / "audio")
+    utils.video_helpers.text_to_speech("Waves roll in.", "0_first", str(tmp_path))
+
+    # Another worker evicts the audio between the lookup and the link.
+    monkeypatch.setattr(
+        utils.video_helpers.TTS_CACHE,
+        "get",
+        lambda key: str(tmp_path / "evicted.wav"),
+    )
+    audio_path, word_timings = utils.video_helpers.text_to_speech(
+        "Waves roll in.", "1_second", str(tmp_path)
+    )
+
+    assert os.path.getsize(audio_path) > 0
+    assert [word for word, _ in word_timings] == ["Waves", "roll", "in."]
+
+
+@pytest.fixture
+def timeline(tmp_path):
+    video_path = str(tmp_path / "timeline.mp4")
+    run_ffmpeg(
+        [
+            "-f", "lavfi", "-i", "color=black:s=64x36:r=24:d=3.58",
+            "-f", "lavfi", "-i", "anullsrc=r=44100:cl=stereo",
+            "-t", "3.58",
+            "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac",
+            video_path,
+        ]
+    )
+    return video_path
+
+
+@pytest.mark.parametrize("replace_audio", [False, True])
+def test_soft_subtitles_keep_the_video_length(timeline, replace_audio, tmp_path):
+    # The only caption ends well before the video does.
+    subtitle_path = tmp_path / "subtitles.srt"
+    subtitle_path.write_text("1\n00:00:00,500 --> 00:00:02,450\nHello\n")
+    audio_path = None
+    if replace_audio:
+        audio_path = tmp_path / "mixed_audio.wav"
+        audio_path.write_bytes(silent_wav(4.0))
+        audio_path = str(audio_path)
+
+    output_path = remux_video(
+        timeline,
+        str(tmp_path / "final.mp4"),
+        audio_path=audio_path,
+        subtitle_path=str(subtitle_path),
+    )
+
+    before = ffmpeg_parse_infos(timeline)["duration"]
+    assert ffmpeg_parse_infos(output_path)["duration"] == pytest.approx(
+        before, abs=0.05
+    )
+
+
+def test_single_output_reads_a_proxy_cropped_to_its_size(timeline):
+    proxy_path = scene_video_proxy(timeline, [(36, 64)], 12)
+
+    assert ffmpeg_parse_infos(proxy_path)["video_size"] == [36, 64]
+
+
+def test_fit_frame_slices_when_one_dimension_matches(monkeypatch):
+    frame = np.arange(720 * 1280 * 3, dtype=np.uint8).reshape(720, 1280, 3)
+    monkeypatch.setattr(utils.video_helpers.Image, "fromarray", None)
+
+    fitted = fit_frame(frame, (720, 720))
+
+    assert fitted.shape == (720, 720, 3)
+    assert np.array_equal(fitted, frame[:, 280:1000])
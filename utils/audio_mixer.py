@@ -0,0 +1,82 @@
+import os
+import wave
+import subprocess
+import numpy as np
+from moviepy.config import get_setting
+
+MUSIC_VOLUME = 0.4
+MUSIC_DUCKING = os.getenv("MUSIC_DUCKING", "false").lower() == "true"
+DUCKING_GAIN = 0.35
+DUCKING_WINDOW_SECONDS = 0.05
+DUCKING_THRESHOLD = 0.02
+DUCKING_SMOOTHING_WINDOWS = 5
+
+
+def decode_audio(audio_path, sample_rate):
+    # ffmpeg decodes and resamples natively. Everything after this is NumPy.
+    command = [
+        get_setting("FFMPEG_BINARY"),
+        "-loglevel", "error",
+        "-i", audio_path,
+        "-f", "f32le",
+        "-ac", "2",
+        "-ar", str(sample_rate),
+        "-",
+    ]
+    output = subprocess.run(command, check=True, capture_output=True).stdout
+    return np.frombuffer(output, dtype=np.float32).reshape(-1, 2)
+
+
+def write_wav(samples, output_path, sample_rate):
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    with wave.open(output_path, "wb") as audio_file:
+        audio_file.setnchannels(2)
+        audio_file.setsampwidth(2)
+        audio_file.setframerate(sample_rate)
+        audio_file.writeframes(pcm.tobytes())
+    return output_path
+
+
+def ducking_envelope(narration, sample_rate):
+    # Per-window speech detection on the narration peak level, smoothed so
+    # the music fades rather than switching hard between gains.
+    window = max(int(sample_rate * DUCKING_WINDOW_SECONDS), 1)
+    windows = -(-len(narration) // window)
+    levels = np.zeros(windows * window, dtype=np.float32)
+    levels[: len(narration)] = np.abs(narration).max(axis=1)
+    speech = levels.reshape(windows, window).max(axis=1) > DUCKING_THRESHOLD
+
+    gain = np.where(speech, DUCKING_GAIN, 1.0)
+    kernel = np.ones(DUCKING_SMOOTHING_WINDOWS) / DUCKING_SMOOTHING_WINDOWS
+    gain = np.convolve(gain, kernel, mode="same")
+    return np.repeat(gain, window)[: len(narration), None].astype(np.float32)
+
+
+def mix_timeline(
+    narration_paths,
+    start_times,
+    duration,
+    sample_rate,
+    output_path,
+    music_file=None,
+    music_volume=MUSIC_VOLUME,
+    ducking=MUSIC_DUCKING,
+):
+    total_samples = int(round(duration * sample_rate))
+    mix = np.zeros((total_samples, 2), dtype=np.float32)
+
+    for narration_path, start_time in zip(narration_paths, start_times):
+        narration = decode_audio(narration_path, sample_rate)
+        offset = int(round(start_time * sample_rate))
+        end = min(offset + len(narration), total_samples)
+        mix[offset:end] += narration[: end - offset]
+
+    if music_file:
+        music = decode_audio(music_file, sample_rate)
+        repeats = -(-total_samples // len(music))
+        music = np.tile(music, (repeats, 1))[:total_samples] * music_volume
+        if ducking:
+            music *= ducking_envelope(mix, sample_rate)
+        mix += music
+
+    return write_wav(mix, output_path, sample_rate)
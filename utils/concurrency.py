@@ -0,0 +1,19 @@
+import os
+
+# Cores are split between concurrent renders (RENDER_WORKERS), the segment
+# processes of each render (SEGMENT_WORKERS) and the x264 threads of each
+# segment encode (ENCODER_THREADS). Few render workers with several segment
+# processes each let a single video use most of the node, and scale with it.
+CPU_COUNT = os.cpu_count() or 1
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", max(CPU_COUNT // 8, 1)))
+SEGMENT_WORKERS = int(
+    os.getenv("SEGMENT_WORKERS", max(CPU_COUNT // (RENDER_WORKERS * 2), 1))
+)
+ENCODER_THREADS = int(
+    os.getenv(
+        "ENCODER_THREADS", max(CPU_COUNT // (RENDER_WORKERS * SEGMENT_WORKERS), 1)
+    )
+)
+# Whole-timeline encodes (burned-in subtitles) run once a render's segments
+# are done, so they get the render worker's whole share.
+JOB_ENCODER_THREADS = max(CPU_COUNT // RENDER_WORKERS, 1)
@@ -3,7 +3,11 @@ from firebase_admin import storage, credentials, firestore
 import os
 import logging as log
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from google.cloud.storage.retry import DEFAULT_RETRY
 from dotenv import load_dotenv
+from utils.disk_cache import hash_file
 
 load_dotenv()
 cred = credentials.Certificate(
@@ -17,18 +21,75 @@ db = firestore.client()
 
 bucket = storage.bucket()
 
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 8))
+# Files above the threshold go through a chunked resumable session, so a
+# dropped connection only retries the current chunk. GCS requires chunk sizes
+# in multiples of 256 KiB.
+RESUMABLE_UPLOAD_THRESHOLD = int(
+    os.getenv("RESUMABLE_UPLOAD_THRESHOLD", 8 * 1024 * 1024)
+)
+UPLOAD_CHUNK_SIZE = 32 * 256 * 1024
+# Cached signed URLs are handed out only while they stay valid for this long.
+SIGNED_URL_MARGIN = datetime.timedelta(minutes=5)
+
+_upload_pool = None
+_upload_pool_lock = threading.Lock()
+_signed_urls = {}
+_signed_urls_lock = threading.Lock()
+
+
+def get_upload_pool():
+    global _upload_pool
+    with _upload_pool_lock:
+        if _upload_pool is None:
+            _upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+        return _upload_pool
+
 
 class DatabaseOperations:
 
     #### BUCKET OPERATIONS ####
 
-    def upload_file_by_path(self, file_path: str, file_name: str):
+    def upload_file_by_path(
+        self, file_path: str, file_name: str, content_hash: str = None
+    ):
+        # Skips the transfer when the blob already holds the same content.
         try:
+            content_hash = content_hash or hash_file(file_path)
+            existing_blob = bucket.get_blob(file_name)
+            if (
+                existing_blob is not None
+                and (existing_blob.metadata or {}).get("sha256") == content_hash
+            ):
+                log.info(f"File already uploaded: {file_name}")
+                return file_name
+
             log.info(f"Uploading file: {file_path}")
-            blob = bucket.blob(file_name)
-            blob.upload_from_filename(file_path)
+            chunk_size = None
+            if os.path.getsize(file_path) > RESUMABLE_UPLOAD_THRESHOLD:
+                chunk_size = UPLOAD_CHUNK_SIZE
+            blob = bucket.blob(file_name, chunk_size=chunk_size)
+            blob.metadata = {"sha256": content_hash}
+            blob.upload_from_filename(file_path, retry=DEFAULT_RETRY)
+            return file_name
         except Exception as e:
             log.error(f"Failed to upload file {file_path}: {e}")
+            return None
+
+    def upload_files(self, uploads: list):
+        # uploads: [(file_path, file_name), ...]. Runs on the shared upload
+        # pool and returns the blob names in order.
+        futures = [
+            get_upload_pool().submit(self.upload_file_by_path, file_path, file_name)
+            for file_path, file_name in uploads
+        ]
+        return [future.result() for future in futures]
+
+    def upload_and_link_files(self, uploads: list):
+        return [
+            self.get_file_link(key=file_name) if file_name else None
+            for file_name in self.upload_files(uploads)
+        ]
 
     def download_file(
         self,
@@ -45,12 +106,27 @@ class DatabaseOperations:
             log.error(f"Failed to download file {key}: {e}")
 
     def get_file_link(self, key: str, expiration: int = 60):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with _signed_urls_lock:
+            cached = _signed_urls.get((key, expiration))
+        if cached and cached[1] - now > SIGNED_URL_MARGIN:
+            return cached[0]
+
         try:
             log.info(f"Generating signed URL for file: {key}")
             blob = bucket.blob(key)
-            url = blob.generate_signed_url(
-                expiration=datetime.timedelta(minutes=expiration), method="GET"
-            )
+            expires_in = datetime.timedelta(minutes=expiration)
+            url = blob.generate_signed_url(expiration=expires_in, method="GET")
+            with _signed_urls_lock:
+                # Entries no longer served are dropped so the cache only holds
+                # live URLs.
+                for stale_key in [
+                    cached_key
+                    for cached_key, (_, expires_at) in _signed_urls.items()
+                    if expires_at - now <= SIGNED_URL_MARGIN
+                ]:
+                    del _signed_urls[stale_key]
+                _signed_urls[(key, expiration)] = (url, now + expires_in)
             return url
         except Exception as e:
             log.error(f"Failed to generate signed URL for {key}: {e}")
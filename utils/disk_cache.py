@@ -0,0 +1,155 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+import logging as log
+
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+# Commits between full rescans of a cache directory. Sizes are tracked
+# per process in between, so entries other processes add are picked up here.
+CACHE_RESCAN_COMMITS = int(os.getenv("CACHE_RESCAN_COMMITS", 64))
+
+
+def hash_key(*parts):
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def hash_file(file_path: str, chunk_size: int = 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(source_path: str, destination_path: str):
+    # Hard links keep the working copy alive even if the cache entry is evicted.
+    if os.path.exists(destination_path):
+        os.remove(destination_path)
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        shutil.copyfile(source_path, destination_path)
+    return destination_path
+
+
+def pin_file(source_path: str, destination_path: str):
+    # Links a cache entry into a request folder under a content-derived name.
+    # An existing file is kept (same name, same content) and a new one appears
+    # atomically, so concurrent readers never see a partial file.
+    if os.path.exists(destination_path):
+        return destination_path
+    temp_path = f"{destination_path}.{uuid.uuid4().hex}.tmp"
+    link_or_copy(source_path, temp_path)
+    os.replace(temp_path, destination_path)
+    return destination_path
+
+
+class DiskCache:
+    # Content-addressed files on local disk, evicted least-recently-used first
+    # once the directory grows past max_bytes. Entries are written atomically
+    # and recency is the file mtime, so several worker processes can share it.
+
+    def __init__(self, name: str, max_bytes: int, suffix: str = ""):
+        self.directory = os.path.join(CACHE_DIR, name)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._total_bytes = None
+        self._commits = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, key: str):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get(self, key: str):
+        file_path = self.path_for(key)
+        try:
+            os.utime(file_path)
+        except FileNotFoundError:
+            return None
+        return file_path
+
+    def put_bytes(self, key: str, data: bytes):
+        temp_path = self._temp_path(key)
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        return self._commit(temp_path, key)
+
+    def put_file(self, key: str, source_path: str, move: bool = False):
+        temp_path = self._temp_path(key)
+        if move:
+            shutil.move(source_path, temp_path)
+        else:
+            shutil.copyfile(source_path, temp_path)
+        return self._commit(temp_path, key)
+
+    def reserve(self, key: str):
+        # Temp path a producer (e.g. ffmpeg) can write to before commit().
+        return self._temp_path(key)
+
+    def commit(self, temp_path: str, key: str):
+        return self._commit(temp_path, key)
+
+    def _temp_path(self, key: str):
+        file_path = self.path_for(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        return f"{file_path}.{uuid.uuid4().hex}.tmp{self.suffix}"
+
+    def _commit(self, temp_path: str, key: str):
+        # The directory is only walked on the first commit, every
+        # CACHE_RESCAN_COMMITS commits and once the running total passes
+        # max_bytes, not on every put.
+        file_path = self.path_for(key)
+        added_bytes = os.path.getsize(temp_path)
+        try:
+            added_bytes -= os.path.getsize(file_path)
+        except FileNotFoundError:
+            pass
+        os.replace(temp_path, file_path)
+
+        with self._lock:
+            self._commits += 1
+            if self._total_bytes is not None:
+                self._total_bytes += added_bytes
+            if (
+                self._total_bytes is None
+                or self._total_bytes > self.max_bytes
+                or self._commits % CACHE_RESCAN_COMMITS == 0
+            ):
+                self._total_bytes = self.evict()
+        return file_path
+
+    def evict(self):
+        # Returns the bytes left in the directory.
+        entries = []
+        total_bytes = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if ".tmp" in name:
+                    continue
+                file_path = os.path.join(root, name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file_path))
+                total_bytes += stat.st_size
+
+        if total_bytes <= self.max_bytes:
+            return total_bytes
+
+        entries.sort()
+        for _, size, file_path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(file_path)
+                total_bytes -= size
+            except FileNotFoundError:
+                pass
+        log.info(f"Evicted cache entries in {self.directory}, {total_bytes} bytes left")
+        return total_bytes
@@ -0,0 +1,174 @@
+import os
+import uuid
+import textwrap
+import tempfile
+
+from utils.video_helpers import (
+    VIDEO_CODEC,
+    AUDIO_CODEC,
+    VIDEO_PRESET,
+    AUDIO_FPS,
+    PREVIEW_CRF,
+    ENCODER_THREADS,
+    JOB_ENCODER_THREADS,
+    overlay_fontsize,
+    audio_duration,
+    frame_count,
+    run_ffmpeg,
+    prepare_photos,
+    scene_video_proxy,
+)
+from PIL import Image
+
+# Mirrors the MoviePy helpers in video_helpers.py: same scaling,
+# looping/trimming to the narration length and overlay and subtitle styling,
+# rendered by a single ffmpeg process.
+
+
+def video_encoder_args(fps, preview=False, threads=ENCODER_THREADS):
+    quality_args = ["-crf", str(PREVIEW_CRF)] if preview else []
+    return [
+        "-c:v", VIDEO_CODEC,
+        "-preset", VIDEO_PRESET,
+        *quality_args,
+        "-threads", str(threads),
+        "-pix_fmt", "yuv420p",
+        "-r", str(fps),
+        "-movflags", "+faststart",
+    ]
+
+
+def encoder_args(fps, preview=False):
+    return video_encoder_args(fps, preview=preview) + [
+        "-c:a", AUDIO_CODEC,
+        "-ar", str(AUDIO_FPS),
+        "-ac", "2",
+    ]
+
+
+def drawtext_filter(text, workdir, **options):
+    # Text goes through textfile= so captions never need filtergraph escaping.
+    text_path = os.path.join(workdir, f"{uuid.uuid4().hex}.txt")
+    with open(text_path, "w", encoding="utf-8") as text_file:
+        text_file.write(text)
+
+    options = {"textfile": f"'{text_path}'", **options}
+    return "drawtext=" + ":".join(f"{key}={value}" for key, value in options.items())
+
+
+def text_overlay_filter(text, workdir, height, preview=False):
+    return drawtext_filter(
+        text["content"],
+        workdir,
+        fontfile=f"'{os.path.join('fonts', text['font'] + '.TTF')}'",
+        fontsize=overlay_fontsize(height),
+        fontcolor="white" if preview else "white@0.8",
+        borderw=0 if preview else 2,
+        bordercolor="black@0.8",
+        x="(w-text_w)/2",
+        y="(h-text_h)/2",
+    )
+
+
+def subtitle_filters(subtitles, workdir):
+    return ",".join(
+        drawtext_filter(
+            textwrap.fill(text.strip().lower(), 70),
+            workdir,
+            fontfile=f"'{os.path.join('fonts', 'trebuchet.TTF')}'",
+            fontsize=35,
+            fontcolor="white@0.6",
+            box=1,
+            boxcolor="black@0.6",
+            x="(w-text_w)/2",
+            y="h-text_h",
+            enable=f"'between(t,{start_time:.3f},{start_time + duration:.3f})'",
+        )
+        for text, start_time, duration in subtitles
+    ) or "null"
+
+
+def photo_input_path(frame, workdir):
+    # Photos go through the same EXIF-aware, aspect-preserving preparation
+    # as the MoviePy path (ffmpeg cannot rotate or decode HEIC itself).
+    media_path = os.path.join(workdir, f"{uuid.uuid4().hex}.png")
+    Image.fromarray(frame).save(media_path, compress_level=1)
+    return media_path
+
+
+def render_scene_outputs(scene, resolutions, fps, output_paths, preview=False):
+    # Renders one scene to several resolutions in one process: a video source
+    # is decoded once from a shared proxy and split into one crop/scale,
+    # overlay and encoder chain per output. Outputs get the same
+    # whole number of frames as the MoviePy path, with the narration padded
+    # with silence to match.
+    frames = frame_count(audio_duration(scene["audio_path"]), fps)
+    # Inputs are read one frame past the end so the fps filter never runs out.
+    duration = f"{(frames + 1) / fps:.6f}"
+    form = scene["type"].split("_")[1]
+    args = []
+    filters = []
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if form == "photo":
+            for frame in prepare_photos(scene["media_path"], resolutions):
+                args += ["-loop", "1", "-framerate", str(fps), "-t", duration]
+                args += ["-i", photo_input_path(frame, workdir)]
+            sources = [f"[{index}:v]" for index in range(len(resolutions))]
+        else:
+            proxy_path = scene_video_proxy(scene["media_path"], resolutions, fps)
+            args += ["-stream_loop", "-1", "-t", duration, "-i", proxy_path]
+            sources = ["[0:v]"]
+            if len(resolutions) > 1:
+                sources = [f"[src{index}]" for index in range(len(resolutions))]
+                filters.append(f"[0:v]split={len(resolutions)}{''.join(sources)}")
+
+        audio_input = args.count("-i")
+        args += ["-i", scene["audio_path"]]
+        audio_labels = [f"[a{index}]" for index in range(len(resolutions))]
+        filters.append(
+            f"[{audio_input}:a]apad=whole_dur={frames / fps:.6f},"
+            f"asplit={len(resolutions)}{''.join(audio_labels)}"
+        )
+
+        outputs = []
+        for index, (res, output_path) in enumerate(zip(resolutions, output_paths)):
+            video_chain = (
+                f"{sources[index]}fps={fps},"
+                f"scale={res[0]}:{res[1]}:force_original_aspect_ratio=increase,"
+                f"crop={res[0]}:{res[1]},setsar=1"
+            )
+            if scene["text_overlay"]:
+                video_chain += "," + text_overlay_filter(
+                    scene["text_overlay"], workdir, res[1], preview=preview
+                )
+            filters.append(f"{video_chain},format=yuv420p[v{index}]")
+            outputs += ["-map", f"[v{index}]", "-map", audio_labels[index]]
+            outputs += ["-frames:v", str(frames)]
+            outputs += encoder_args(fps, preview=preview) + [output_path]
+
+        run_ffmpeg(args + ["-filter_complex", ";".join(filters)] + outputs)
+
+    return output_paths
+
+
+def burn_subtitles(video_path, subtitles, output_path, fps, audio_path=None):
+    # Without a separately mixed track the segment audio is stream-copied.
+    args = ["-i", video_path]
+    audio_map, audio_args = "0:a", ["-c:a", "copy"]
+    if audio_path:
+        args += ["-i", audio_path]
+        audio_map = "1:a"
+        audio_args = ["-c:a", AUDIO_CODEC, "-ar", str(AUDIO_FPS), "-ac", "2"]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        run_ffmpeg(
+            args
+            + ["-filter_complex", f"[0:v]{subtitle_filters(subtitles, workdir)}[vsub]"]
+            + ["-map", "[vsub]", "-map", audio_map, "-shortest"]
+            + video_encoder_args(fps, threads=JOB_ENCODER_THREADS)
+            + audio_args
+            + [output_path]
+        )
+
+    return output_path
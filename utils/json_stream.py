@@ -0,0 +1,61 @@
+import re
+import json
+import logging as log
+
+
+class JsonArrayStreamParser:
+    # Incrementally scans streamed model output and returns each object of the
+    # array under `key` as soon as its closing brace arrives, so work on early
+    # items can start before the response is complete.
+
+    def __init__(self, key: str):
+        self.key_pattern = re.compile(rf'"{re.escape(key)}"\s*:\s*\[')
+        self.buffer = ""
+        self.position = None
+        self.depth = 0
+        self.object_start = None
+        self.in_string = False
+        self.escaped = False
+        self.done = False
+
+    def feed(self, text: str):
+        self.buffer += text
+        if self.done:
+            return []
+
+        if self.position is None:
+            match = self.key_pattern.search(self.buffer)
+            if not match:
+                return []
+            self.position = match.end()
+
+        objects = []
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                if self.depth == 0:
+                    self.object_start = self.position
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    raw_object = self.buffer[self.object_start : self.position + 1]
+                    try:
+                        objects.append(json.loads(raw_object))
+                    except json.JSONDecodeError:
+                        log.error(f"Could not parse streamed object: {raw_object}")
+            elif char == "]" and self.depth == 0:
+                self.done = True
+                break
+            self.position += 1
+
+        return objects
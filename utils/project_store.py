@@ -0,0 +1,129 @@
+import copy
+import logging as log
+from utils.disk_cache import hash_key
+
+PROJECT_COLLECTION = "projects"
+
+
+class ProjectNotFoundError(Exception):
+    pass
+
+
+def save_project(
+    database_operations,
+    project_id: str,
+    rendered_script: dict,
+    segment_keys: dict,
+    script: dict = None,
+):
+    # segment_keys maps a render profile (e.g. "final_16x9", "preview_9x16")
+    # to the SEGMENT_CACHE entry each scene was rendered to. Each is stored
+    # with a hash of the scene it came from, so a later edit only reuses
+    # segments of scenes that are unchanged. The project is re-read first so
+    # a render that did not change the script (script=None, e.g. a background
+    # finalize) keeps any newer edit and the other profiles' segments.
+    project = database_operations.get_document(PROJECT_COLLECTION, project_id) or {}
+    segments = dict(project.get("segments", {}))
+    for profile, keys in segment_keys.items():
+        segments[profile] = [
+            {"scene": hash_key(scene), "key": key}
+            for scene, key in zip(rendered_script["scenes"], keys)
+        ]
+    database_operations.create_document(
+        PROJECT_COLLECTION,
+        project_id,
+        {
+            "script": script or project.get("script", rendered_script),
+            "segments": segments,
+        },
+    )
+
+
+def load_project(database_operations, project_id: str):
+    project = database_operations.get_document(PROJECT_COLLECTION, project_id)
+    if project is None:
+        raise ProjectNotFoundError(f"Project {project_id} not found")
+    return project
+
+
+def apply_script_patch(script: dict, patch: dict):
+    # patch["changes"] replaces top-level script fields (musicInput, music,
+    # subtitleInput, ...). patch["scenes"] maps a scene index to the fields
+    # to update; the index one past the end appends a scene, null removes
+    # the trailing scenes from that index on. A scene given a new media_url
+    # loses the bucket key of its old user media. Returns the patched script
+    # and the indices of the scenes whose content changed.
+    changes = patch.get("changes", {})
+    scene_patches = patch.get("scenes", {})
+    if not isinstance(changes, dict) or not isinstance(scene_patches, dict):
+        raise ValueError("changes and scenes must be objects")
+
+    patched = copy.deepcopy(script)
+    patched.update({key: value for key, value in changes.items() if key != "scenes"})
+    scenes = patched["scenes"]
+    changed_scenes = set()
+
+    for index, fields in sorted(
+        ((int(index), fields) for index, fields in scene_patches.items()),
+        key=lambda item: item[0],
+    ):
+        if index < 0 or index > len(scenes):
+            raise ValueError(f"Scene {index} is out of range")
+        if fields is None:
+            del scenes[index:]
+            continue
+        if not isinstance(fields, dict):
+            raise ValueError(f"Scene {index} must be an object or null")
+        if index == len(scenes):
+            scenes.append({})
+
+        scene = {**scenes[index], **fields}
+        if "media_url" in fields and "media_key" not in fields:
+            scene.pop("media_key", None)
+        if scene != scenes[index]:
+            scenes[index] = scene
+            changed_scenes.add(index)
+
+    changed_scenes = {index for index in changed_scenes if index < len(scenes)}
+    log.info(f"Patched project script, changed scenes: {sorted(changed_scenes)}")
+    return patched, changed_scenes
+
+
+def reusable_segment_keys(project: dict, script: dict, changed_scenes, profiles):
+    # Per scene, the segment key of every profile in order, or None where the
+    # scene has to be rendered.
+    stored_segments = (project or {}).get("segments", {})
+    segment_keys = []
+    for index, scene in enumerate(script["scenes"]):
+        if changed_scenes is None or index in changed_scenes:
+            segment_keys.append(None)
+            continue
+
+        scene_hash = hash_key(scene)
+        keys = []
+        for profile in profiles:
+            entries = stored_segments.get(profile, [])
+            entry = entries[index] if index < len(entries) else None
+            if entry is None or entry["scene"] != scene_hash:
+                keys = None
+                break
+            keys.append(entry["key"])
+        segment_keys.append(keys)
+    return segment_keys
+
+
+def resolve_edit_request(database_operations, request_body: dict):
+    # Full-script requests keep working. Project requests load the stored
+    # script and apply the patch. Returns (project_id, project, script,
+    # changed_scenes); changed_scenes is None when every scene must be
+    # rendered.
+    if not isinstance(request_body, dict):
+        raise ValueError("Edit request must be an object")
+
+    project_id = request_body.get("project_id")
+    if project_id is None:
+        return None, None, request_body, None
+
+    project = load_project(database_operations, project_id)
+    script, changed_scenes = apply_script_patch(project["script"], request_body)
+    return project_id, project, script, changed_scenes
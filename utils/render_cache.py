@@ -0,0 +1,138 @@
+import os
+import threading
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.disk_cache import DiskCache, hash_key, hash_file, link_or_copy
+from utils.video_helpers import (
+    VIDEO_CODEC,
+    AUDIO_CODEC,
+    VIDEO_PRESET,
+    RENDER_BACKEND,
+    PHOTO_FIT,
+    build_scene_clips,
+    write_videos,
+)
+from utils import ffmpeg_backend
+from utils.concurrency import SEGMENT_WORKERS
+
+SEGMENT_CACHE = DiskCache(
+    "segments",
+    int(os.getenv("SEGMENT_CACHE_MAX_BYTES", 4 * 1024 * 1024 * 1024)),
+    suffix=".mp4",
+)
+# Videos are scaled to cover each output and center-cropped, never stretched.
+SEGMENT_FRAMING = "cover"
+
+_segment_pool = None
+_segment_pool_lock = threading.Lock()
+
+
+def segment_keys(scene, resolutions, fps, preview=False):
+    media_hash = hash_file(scene["media_path"])
+    audio_hash = hash_file(scene["audio_path"])
+    return [
+        hash_key(
+            scene["type"],
+            media_hash,
+            audio_hash,
+            scene.get("text_overlay"),
+            list(res),
+            fps,
+            VIDEO_CODEC,
+            AUDIO_CODEC,
+            VIDEO_PRESET,
+            RENDER_BACKEND,
+            PHOTO_FIT,
+            preview,
+            SEGMENT_FRAMING,
+        )
+        for res in resolutions
+    ]
+
+
+def render_scene_segments(scene, resolutions, fps, preview=False):
+    # Every missing output of a scene comes from one render pass, so the
+    # scene's media is decoded once however many resolutions are requested.
+    keys = segment_keys(scene, resolutions, fps, preview)
+    segment_paths = [SEGMENT_CACHE.get(key) for key in keys]
+    missing = [index for index, path in enumerate(segment_paths) if path is None]
+    if not missing:
+        return segment_paths
+
+    missing_resolutions = [resolutions[index] for index in missing]
+    temp_paths = [SEGMENT_CACHE.reserve(keys[index]) for index in missing]
+    try:
+        if RENDER_BACKEND == "ffmpeg":
+            ffmpeg_backend.render_scene_outputs(
+                scene, missing_resolutions, fps, temp_paths, preview=preview
+            )
+        else:
+            clips = build_scene_clips(scene, missing_resolutions, fps, preview=preview)
+            try:
+                write_videos(clips, temp_paths, fps, preview=preview)
+            finally:
+                for clip in clips:
+                    clip.close()
+    except Exception:
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+
+    for index, temp_path in zip(missing, temp_paths):
+        segment_paths[index] = SEGMENT_CACHE.commit(temp_path, keys[index])
+    return segment_paths
+
+
+def get_segment_pool():
+    # MoviePy frame generation is single-threaded, so scenes are encoded in
+    # separate processes. The pool lives for the whole worker process.
+    global _segment_pool
+    with _segment_pool_lock:
+        if _segment_pool is None:
+            _segment_pool = ProcessPoolExecutor(
+                max_workers=SEGMENT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return _segment_pool
+
+
+def segment_cache_key(segment_path: str):
+    # Rendered segment paths are SEGMENT_CACHE entries named by their key.
+    return os.path.basename(segment_path)[: -len(SEGMENT_CACHE.suffix)]
+
+
+def cached_segment(key: str):
+    return SEGMENT_CACHE.get(key)
+
+
+def render_segment_stage(index, scene, resolutions, fps, preview=False):
+    # Returns one segment per output resolution. Scenes reused from an earlier
+    # render of the project already carry their segments and skip the media
+    # fetch and the encode.
+    if scene.get("segment_paths"):
+        return scene["segment_paths"]
+    return render_scene_segments(scene, resolutions, fps, preview)
+
+
+def scene_render_stage(resolutions, fps, preview=False):
+    # (fn, executor) pair that builds and encodes one scene in the segment
+    # process pool, for use as the last stage of a ScenePipeline.
+    return (
+        partial(
+            render_segment_stage, resolutions=resolutions, fps=fps, preview=preview
+        ),
+        get_segment_pool(),
+    )
+
+
+def link_segments(segment_paths, output_dir: str):
+    # Segments are linked into the request's folder so a concurrent eviction
+    # cannot remove them before they are concatenated.
+    os.makedirs(output_dir, exist_ok=True)
+    return [
+        link_or_copy(segment_path, os.path.join(output_dir, f"{index}.mp4"))
+        for index, segment_path in enumerate(segment_paths)
+    ]
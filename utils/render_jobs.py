@@ -0,0 +1,120 @@
+import os
+import time
+import uuid
+import asyncio
+import logging as log
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from utils.concurrency import RENDER_WORKERS
+
+RENDER_JOB_TTL = int(os.getenv("RENDER_JOB_TTL", 3600))
+
+
+def _run_job(job_id: str, progress, fn, args: tuple):
+    def on_progress(stage: str):
+        progress[job_id] = stage
+
+    return fn(*args, on_progress=on_progress)
+
+
+class RenderJobManager:
+    # Renders run in "spawn" workers so each process sets up its own
+    # firebase / gRPC clients instead of inheriting them through fork.
+
+    def __init__(self, max_workers: int = RENDER_WORKERS):
+        self.max_workers = max_workers
+        self.jobs = {}
+        self.executor = None
+        self.manager = None
+        self.progress = None
+
+    def start(self):
+        if self.executor is not None:
+            return
+        context = multiprocessing.get_context("spawn")
+        self.manager = context.Manager()
+        self.progress = self.manager.dict()
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=context
+        )
+        log.info(f"Started render pool with {self.max_workers} workers")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.manager.shutdown()
+            self.executor = None
+
+    def submit(self, fn, *args):
+        self.start()
+        self.prune()
+        job_id = str(uuid.uuid4())
+        self.progress[job_id] = "queued"
+        future = self.executor.submit(_run_job, job_id, self.progress, fn, args)
+        self.jobs[job_id] = {"future": future, "created_at": time.time()}
+        log.info(f"Submitted render job {job_id}")
+        return job_id
+
+    def submit_after(self, parent_id: str, fn, *args):
+        # Queues fn once the parent job has succeeded, e.g. a finalize render
+        # that reads what a preview job saved. It fails if the parent does.
+        self.prune()
+        job_id = str(uuid.uuid4())
+        self.progress[job_id] = "waiting"
+        future = Future()
+        self.jobs[job_id] = {"future": future, "created_at": time.time()}
+
+        def forward(job_future):
+            if job_future.cancelled():
+                future.cancel()
+            elif job_future.exception() is not None:
+                future.set_exception(job_future.exception())
+            else:
+                future.set_result(job_future.result())
+
+        def start(parent_future):
+            if parent_future.cancelled() or parent_future.exception() is not None:
+                future.set_exception(RuntimeError(f"Job {parent_id} did not finish"))
+                return
+            if self.executor is None:
+                future.set_exception(RuntimeError("Render pool is shut down"))
+                return
+            future.set_running_or_notify_cancel()
+            self.progress[job_id] = "queued"
+            self.executor.submit(
+                _run_job, job_id, self.progress, fn, args
+            ).add_done_callback(forward)
+
+        self.jobs[parent_id]["future"].add_done_callback(start)
+        log.info(f"Submitted render job {job_id} after {parent_id}")
+        return job_id
+
+    async def run(self, fn, *args):
+        job_id = self.submit(fn, *args)
+        return await asyncio.wrap_future(self.jobs[job_id]["future"])
+
+    def get(self, job_id: str):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+
+        future = job["future"]
+        status = {"job_id": job_id, "stage": self.progress.get(job_id)}
+        if not future.done():
+            status["status"] = "running" if future.running() else "queued"
+        elif future.cancelled():
+            status["status"] = "cancelled"
+        elif future.exception() is not None:
+            status["status"] = "failed"
+            status["error"] = str(future.exception())
+        else:
+            status["status"] = "done"
+            status["result"] = future.result()
+        return status
+
+    def prune(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job["future"].done() and now - job["created_at"] > RENDER_JOB_TTL:
+                del self.jobs[job_id]
+                self.progress.pop(job_id, None)
@@ -0,0 +1,40 @@
+from concurrent.futures import Future
+
+
+class ScenePipeline:
+    # Moves every scene through an ordered list of (fn, executor) stages on
+    # its own: a scene enters the next stage as soon as its previous stage
+    # finishes, so a slow scene only holds up itself. Each stage function is
+    # called as fn(index, value) and its result is passed to the next stage.
+
+    def __init__(self, stages: list):
+        self.stages = stages
+
+    def submit(self, index: int, item):
+        result = Future()
+        self._advance(index, item, 0, result)
+        return result
+
+    def run(self, items: list):
+        futures = [self.submit(index, item) for index, item in enumerate(items)]
+        return [future.result() for future in futures]
+
+    def _advance(self, index: int, value, stage_index: int, result: Future):
+        if stage_index == len(self.stages):
+            result.set_result(value)
+            return
+
+        fn, executor = self.stages[stage_index]
+        try:
+            future = executor.submit(fn, index, value)
+        except Exception as e:
+            result.set_exception(e)
+            return
+
+        def on_done(future):
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                self._advance(index, future.result(), stage_index + 1, result)
+
+        future.add_done_callback(on_done)
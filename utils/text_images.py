@@ -0,0 +1,52 @@
+import os
+import math
+import numpy as np
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+
+TEXT_CACHE_SIZE = int(os.getenv("TEXT_CACHE_SIZE", 512))
+
+
+@lru_cache(maxsize=64)
+def load_font(font_path: str, fontsize: int):
+    return ImageFont.truetype(font_path, fontsize)
+
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def render_text(
+    text: str,
+    font_path: str,
+    fontsize: int,
+    color: str,
+    stroke_color: str = None,
+    stroke_width: int = 0,
+    bg_color: str = None,
+    padding: int = 0,
+):
+    # Returns a read-only RGBA frame. Frames are shared between every clip
+    # that uses the same text and style, so callers must not modify them.
+    font = load_font(font_path, fontsize)
+    measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    left, top, right, bottom = measure.multiline_textbbox(
+        (0, 0), text, font=font, align="center", stroke_width=stroke_width
+    )
+
+    # Centered multiline bounds can be fractional.
+    size = (
+        math.ceil(right - left) + 2 * padding,
+        math.ceil(bottom - top) + 2 * padding,
+    )
+    image = Image.new("RGBA", size, bg_color or (0, 0, 0, 0))
+    ImageDraw.Draw(image).multiline_text(
+        (padding - left, padding - top),
+        text,
+        font=font,
+        fill=color,
+        align="center",
+        stroke_width=stroke_width,
+        stroke_fill=stroke_color,
+    )
+
+    frame = np.array(image)
+    frame.flags.writeable = False
+    return frame
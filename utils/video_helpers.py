@@ -1,22 +1,111 @@
 from moviepy.editor import (
-    TextClip,
     ImageClip,
     VideoFileClip,
     CompositeVideoClip,
     AudioFileClip,
-    CompositeAudioClip,
     concatenate_videoclips,
     vfx,
 )
-from moviepy.video.fx.resize import resize
-import google.cloud.texttospeech as tts
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+import google.cloud.texttospeech_v1beta1 as tts
+from google.api_core.exceptions import InvalidArgument
 from google.cloud import speech_v1p1beta1 as speech
-from urllib.parse import urlparse
+from urllib.parse import urlparse, unquote
+from utils.disk_cache import DiskCache, hash_key, hash_file, link_or_copy, pin_file
+from utils.text_images import render_text
+from utils.concurrency import ENCODER_THREADS, JOB_ENCODER_THREADS
+from PIL import Image, ImageOps
+from functools import lru_cache, partial
+import threading
+import subprocess
+import tempfile
+from requests.adapters import HTTPAdapter
+import numpy as np
 import requests
+import logging as log
+from xml.sax.saxutils import escape
 import textwrap
+import json
+import math
+import re
+import wave
 import io
 import os
 
+try:
+    from pillow_heif import register_heif_opener
+
+    register_heif_opener()
+except ImportError:
+    register_heif_opener = None
+
+TTS_LANGUAGE_CODE = "en-US"
+TTS_VOICE_NAME = "en-US-Studio-O"
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", 8))
+TTS_CACHE = DiskCache(
+    "tts", int(os.getenv("TTS_CACHE_MAX_BYTES", 512 * 1024 * 1024)), suffix=".wav"
+)
+TTS_TIMEPOINT_CACHE = DiskCache(
+    "tts_timepoints",
+    int(os.getenv("TTS_CACHE_MAX_BYTES", 512 * 1024 * 1024)) // 16,
+    suffix=".json",
+)
+# SSML <mark> timepoints give per-word subtitle timing without speech-to-text.
+TTS_TIMEPOINTS = os.getenv("TTS_TIMEPOINTS", "true").lower() == "true"
+STT_CHUNK_SECONDS = 55
+
+VIDEO_CODEC = "libx264"
+AUDIO_CODEC = "aac"
+VIDEO_PRESET = "ultrafast"
+AUDIO_FPS = 44100
+# Preview renders trade bitrate (x264 CRF) and overlay styling for speed.
+# Final renders keep the encoder's default quality.
+PREVIEW_CRF = 32
+# "moviepy" composites frames in Python, "ffmpeg" compiles scenes into a
+# native filter graph (utils/ffmpeg_backend.py).
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "moviepy")
+# "burn" composites captions into the frames, "soft" muxes a mov_text track
+# and returns SRT/WebVTT sidecars. Requests can override it with subtitleMode.
+SUBTITLE_MODE = os.getenv("SUBTITLE_MODE", "burn")
+# Photos keep their aspect ratio: "pad" letterboxes them into the render
+# resolution, "crop" fills it.
+PHOTO_FIT = os.getenv("PHOTO_FIT", "pad")
+PHOTO_CACHE_SIZE = int(os.getenv("PHOTO_CACHE_SIZE", 16))
+KEYFRAME_INTERVAL_SECONDS = 5
+KEYFRAME_MIN_COUNT = 3
+KEYFRAME_MAX_COUNT = 12
+KEYFRAME_WIDTH = 512
+PROXY_CACHE = DiskCache(
+    "proxies",
+    int(os.getenv("PROXY_CACHE_MAX_BYTES", 4 * 1024 * 1024 * 1024)),
+    suffix=".mp4",
+)
+
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 8))
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+STOCK_CACHE = DiskCache(
+    "stock", int(os.getenv("STOCK_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+)
+# Node-local copy of user media keyed by content hash. The bucket stores user
+# media as media/<sha256><ext>, so a signed URL resolves to its entry without
+# any transfer.
+MEDIA_STORE = DiskCache(
+    "media", int(os.getenv("MEDIA_STORE_MAX_BYTES", 4 * 1024 * 1024 * 1024))
+)
+CONTENT_NAME_PATTERN = re.compile(r"^([0-9a-f]{64})(\.\w+)?$")
+
+_http_session = None
+_http_session_lock = threading.Lock()
+_download_locks = {}
+_download_locks_lock = threading.Lock()
+_tts_client = None
+_tts_client_lock = threading.Lock()
+
 
 class VideoTransitionHelper:
     @staticmethod
@@ -78,62 +167,378 @@ class VideoTransitionHelper:
             return concatenate_videoclips([clip1, clip2])
 
 
-def create_video_clip(video_path, audio_path, res, fps):
+def get_video_proxy(video_path, res, fps, crop=False):
+    # Transcodes a source video once into a silent proxy at the render size
+    # and frame rate, so decode and resize cost per output frame no longer
+    # depends on the source resolution. The aspect ratio is kept and the proxy
+    # covers res, so outputs crop it instead of squashing it. With crop the
+    # proxy is already center-cropped to exactly res.
+    framing = "crop" if crop else "cover"
+    cache_key = hash_key(hash_file(video_path), list(res), fps, framing)
+    scale = f"scale={res[0]}:{res[1]}:force_original_aspect_ratio=increase,"
+    if crop:
+        scale += f"crop={res[0]}:{res[1]}"
+    else:
+        scale += "scale=trunc(iw/2)*2:trunc(ih/2)*2"
+    # Renders read the proxy through a link next to the source in the request
+    # folder, so evicting the cache entry cannot remove it mid-render.
+    pinned_path = f"{os.path.splitext(video_path)[0]}.{cache_key[:16]}.proxy.mp4"
+    if os.path.exists(pinned_path):
+        return pinned_path
+
+    proxy_path = PROXY_CACHE.get(cache_key)
+    if proxy_path is not None:
+        try:
+            return pin_file(proxy_path, pinned_path)
+        except FileNotFoundError:
+            pass
+
+    temp_path = PROXY_CACHE.reserve(cache_key)
+    try:
+        run_ffmpeg(
+            [
+                "-i", video_path,
+                "-map", "0:v:0",
+                "-an",
+                "-vf", f"fps={fps},{scale},setsar=1",
+                "-c:v", VIDEO_CODEC,
+                "-preset", VIDEO_PRESET,
+                "-crf", "18",
+                "-threads", str(ENCODER_THREADS),
+                "-g", str(fps),
+                "-pix_fmt", "yuv420p",
+                temp_path,
+            ]
+        )
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    pin_file(temp_path, pinned_path)
+    PROXY_CACHE.commit(temp_path, cache_key)
+    return pinned_path
+
+
+def sample_keyframes(video_path, output_dir):
+    # One ffmpeg pass picks the first frame, scene changes, and a forced frame
+    # whenever the gap since the last pick exceeds the duration-based interval.
+    duration = ffmpeg_parse_infos(video_path)["duration"]
+    count = int(duration // KEYFRAME_INTERVAL_SECONDS)
+    count = min(max(count, KEYFRAME_MIN_COUNT), KEYFRAME_MAX_COUNT)
+    interval = duration / count
+    select = (
+        "isnan(prev_selected_t)"
+        f"+gt(scene,0.3)*gte(t-prev_selected_t,{interval / 2:.3f})"
+        f"+gte(t-prev_selected_t,{interval:.3f})"
+    )
+
+    os.makedirs(output_dir, exist_ok=True)
+    run_ffmpeg(
+        [
+            "-i", video_path,
+            "-an",
+            "-vf", f"select='{select}',scale={KEYFRAME_WIDTH}:-2",
+            "-vsync", "vfr",
+            "-frames:v", str(KEYFRAME_MAX_COUNT),
+            "-q:v", "4",
+            os.path.join(output_dir, "%03d.jpg"),
+        ]
+    )
+    frame_paths = sorted(
+        os.path.join(output_dir, name)
+        for name in os.listdir(output_dir)
+        if name.endswith(".jpg")
+    )
+    return frame_paths, duration
+
+
+def scene_video_proxy(video_path, resolutions, fps):
+    # A single output reads a proxy cropped to its size, several share one
+    # that covers all of them.
+    if len(resolutions) == 1:
+        return get_video_proxy(video_path, resolutions[0], fps, crop=True)
+    return get_video_proxy(video_path, cover_resolution(resolutions), fps)
+
+
+def create_video_clip(video_path, audio_path, resolutions, fps):
     audio = AudioFileClip(audio_path)
     duration = audio.duration
-    video = VideoFileClip(video_path).set_fps(fps)
-    video = resize(video, width=res[0], height=res[1])
+    video = VideoFileClip(
+        scene_video_proxy(video_path, resolutions, fps), audio=False
+    )
 
     if video.duration > duration:
         video = video.subclip(0, duration)
     elif video.duration < duration:
-        repeats = int(duration // video.duration) + 1
-        video = concatenate_videoclips([video] * repeats).subclip(0, duration)
+        # Wraps the time back to the start of the same reader instead of
+        # compositing a concatenation of copies.
+        video = video.fx(vfx.loop, duration=duration)
 
     video = video.set_audio(audio)
 
     return video
 
 
-def create_photo_clip(photo_path, audio_path, res):
+@lru_cache(maxsize=PHOTO_CACHE_SIZE)
+def _prepare_photos(photo_path, modified_time, resolutions, fit):
+    # The original is decoded once for every output size and only the fitted
+    # frames are kept.
+    with Image.open(photo_path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+
+    frames = []
+    for res in resolutions:
+        if fit == "crop":
+            fitted = ImageOps.fit(image, res, Image.LANCZOS)
+        else:
+            fitted = ImageOps.pad(image, res, Image.LANCZOS, color=(0, 0, 0))
+        frame = np.array(fitted)
+        frame.flags.writeable = False
+        frames.append(frame)
+    return tuple(frames)
+
+
+def prepare_photos(photo_path, resolutions):
+    # Decodes, rotates and scales a photo once per scene, so a still scene
+    # costs no per-frame resampling. Frames are shared and must not be
+    # modified.
+    return _prepare_photos(
+        photo_path,
+        os.path.getmtime(photo_path),
+        tuple(tuple(res) for res in resolutions),
+        PHOTO_FIT,
+    )
+
+
+def create_photo_clip(frame, audio_path):
     audio = AudioFileClip(audio_path)
     duration = audio.duration
-    photo = ImageClip(photo_path).set_duration(duration)
-    photo = resize(photo, width=res[0], height=res[1])
+    photo = ImageClip(frame).set_duration(duration)
 
     photo = photo.set_audio(audio)
     return photo
 
 
-def add_text_overlay(clip, text):
-    font_path = os.path.join("fonts", text["font"] + ".TTF")
-    text_clip = (
-        TextClip(
-            text["content"],
-            fontsize=100,
-            color="white",
-            font=font_path,
-            stroke_color="black",
-            stroke_width=2,
+def cover_resolution(resolutions):
+    # Smallest size every output resolution fits inside.
+    return max(res[0] for res in resolutions), max(res[1] for res in resolutions)
+
+
+def fit_frame(frame, res):
+    # Center-crops to the aspect ratio of res with a slice. The cover proxy
+    # matches res in one dimension for most output sets, so only frames
+    # larger in both dimensions are resized.
+    height, width = frame.shape[:2]
+    crop_width = min(width, round(height * res[0] / res[1]))
+    crop_height = min(height, round(width * res[1] / res[0]))
+    top, left = (height - crop_height) // 2, (width - crop_width) // 2
+    frame = frame[top : top + crop_height, left : left + crop_width]
+    if (crop_width, crop_height) == tuple(res):
+        return frame
+    image = Image.fromarray(np.ascontiguousarray(frame))
+    return np.asarray(image.resize(tuple(res), Image.BILINEAR))
+
+
+def build_scene_clips(scene, resolutions, fps, preview: bool = False):
+    # One clip per output resolution. Video outputs share a single reader over
+    # one proxy and are center-cropped per output, so each source frame is
+    # decoded once when written with write_videos.
+    form = scene["type"].split("_")[1]
+    if form == "photo":
+        clips = [
+            create_photo_clip(frame, scene["audio_path"])
+            for frame in prepare_photos(scene["media_path"], resolutions)
+        ]
+    elif form == "video":
+        source = create_video_clip(
+            scene["media_path"], scene["audio_path"], resolutions, fps
         )
-        .set_opacity(0.8)
-        .set_position("center")
-        .set_duration(clip.duration)
+        clips = [
+            source.fl_image(partial(fit_frame, res=tuple(res))) for res in resolutions
+        ]
+
+    if scene["text_overlay"]:
+        clips = [
+            add_text_overlay(clip, scene["text_overlay"], preview=preview)
+            for clip in clips
+        ]
+
+    return clips
+
+
+def write_video(clip, output_path, fps, preview: bool = False):
+    # Whole-timeline render (burned-in subtitles), with the encoder settings
+    # of the segments.
+    clip.write_videofile(
+        output_path,
+        codec=VIDEO_CODEC,
+        audio_codec=AUDIO_CODEC,
+        fps=fps,
+        preset=VIDEO_PRESET,
+        ffmpeg_params=["-crf", str(PREVIEW_CRF)] if preview else None,
+        audio_fps=AUDIO_FPS,
+        threads=JOB_ENCODER_THREADS,
+        temp_audiofile=output_path + ".m4a",
+        logger=None,
     )
+    return output_path
+
+
+def write_videos(clips, output_paths, fps, preview: bool = False):
+    # Writes clips of the same scene frame by frame in lockstep: clips that
+    # share a reader get each source frame from its last-read buffer instead
+    # of decoding it again. The audio track is encoded once and muxed into
+    # every output.
+    audio_path = output_paths[0] + ".m4a"
+    clips[0].audio.write_audiofile(
+        audio_path, fps=AUDIO_FPS, codec=AUDIO_CODEC, logger=None
+    )
+    writers = [
+        FFMPEG_VideoWriter(
+            output_path,
+            clip.size,
+            fps,
+            codec=VIDEO_CODEC,
+            preset=VIDEO_PRESET,
+            audiofile=audio_path,
+            threads=ENCODER_THREADS,
+            ffmpeg_params=["-crf", str(PREVIEW_CRF)] if preview else None,
+        )
+        for clip, output_path in zip(clips, output_paths)
+    ]
+    try:
+        for frame in range(frame_count(clips[0].duration, fps)):
+            for clip, writer in zip(clips, writers):
+                writer.write_frame(clip.get_frame(frame / fps).astype("uint8"))
+    finally:
+        for writer in writers:
+            writer.close()
+        os.remove(audio_path)
+    return output_paths
+
+
+def run_ffmpeg(args):
+    command = [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error"] + args
+    subprocess.run(command, check=True, capture_output=True)
+
+
+def concatenate_segments(segment_paths, output_path):
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as list_file:
+        for segment_path in segment_paths:
+            escaped_path = os.path.abspath(segment_path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped_path}'\n")
+
+    try:
+        run_ffmpeg(
+            [
+                "-f", "concat",
+                "-safe", "0",
+                "-i", list_file.name,
+                "-c", "copy",
+                "-movflags", "+faststart",
+                output_path,
+            ]
+        )
+    finally:
+        os.remove(list_file.name)
+
+    return output_path
+
+
+def remux_video(
+    video_path,
+    output_path,
+    audio_path=None,
+    subtitle_path=None,
+    audio_codec=AUDIO_CODEC,
+):
+    # Video is always stream-copied. A separate audio track (encoded with
+    # audio_codec, "copy" when it is already AAC) replaces the segment audio,
+    # and subtitles are added as a soft mov_text track. The video sets the
+    # length: a replacement track is cut to it and captions never shorten it.
+    args = ["-i", video_path]
+    maps = ["-map", "0:v", "-map", "0:a"]
+    codecs = ["-c:v", "copy", "-c:a", "copy"]
+    limit = []
+
+    if audio_path:
+        args += ["-i", audio_path]
+        maps[3] = f"{args.count('-i') - 1}:a"
+        codecs[3] = audio_codec
+        limit = ["-t", f"{ffmpeg_parse_infos(video_path)['duration']:.3f}"]
+
+    if subtitle_path:
+        args += ["-i", subtitle_path]
+        maps += ["-map", f"{args.count('-i') - 1}:s"]
+        codecs += ["-c:s", "mov_text", "-metadata:s:s:0", "language=eng"]
+
+    run_ffmpeg(args + maps + codecs + limit + ["-movflags", "+faststart", output_path])
+    return output_path
+
+
+def format_timestamp(seconds, decimal_separator):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600 * 1000)
+    minutes, milliseconds = divmod(milliseconds, 60 * 1000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02}:{minutes:02}:{seconds:02}{decimal_separator}{milliseconds:03}"
+
+
+def write_srt(subtitle_segments, output_path):
+    with open(output_path, "w", encoding="utf-8") as file:
+        for index, (text, start_time, duration) in enumerate(subtitle_segments, 1):
+            start = format_timestamp(start_time, ",")
+            end = format_timestamp(start_time + duration, ",")
+            file.write(f"{index}\n{start} --> {end}\n{text.strip()}\n\n")
+    return output_path
+
+
+def write_webvtt(subtitle_segments, output_path):
+    with open(output_path, "w", encoding="utf-8") as file:
+        file.write("WEBVTT\n\n")
+        for text, start_time, duration in subtitle_segments:
+            start = format_timestamp(start_time, ".")
+            end = format_timestamp(start_time + duration, ".")
+            file.write(f"{start} --> {end}\n{text.strip()}\n\n")
+    return output_path
+
+
+def overlay_fontsize(height):
+    # Sized for 720p and scaled with the render height.
+    return max(round(100 * height / 720), 1)
+
+
+def add_text_overlay(clip, text, preview: bool = False):
+    # Previews draw the text without stroke or opacity blending.
+    font_path = os.path.join("fonts", text["font"] + ".TTF")
+    text_image = render_text(
+        text["content"],
+        font_path,
+        fontsize=overlay_fontsize(clip.h),
+        color="white",
+        stroke_color=None if preview else "black",
+        stroke_width=0 if preview else 2,
+    )
+    text_clip = ImageClip(text_image, transparent=True)
+    if not preview:
+        text_clip = text_clip.set_opacity(0.8)
+    text_clip = text_clip.set_position("center").set_duration(clip.duration)
 
     return CompositeVideoClip([clip, text_clip])
 
 
 def add_subtitle(text, start_time, duration):
     wrap_txt = textwrap.fill(text.strip().lower(), 70)
+    text_image = render_text(
+        wrap_txt,
+        os.path.join("fonts", "trebuchet.TTF"),
+        fontsize=35,
+        color="white",
+        bg_color="black",
+        padding=4,
+    )
     text_clip = (
-        TextClip(
-            wrap_txt,
-            fontsize=35,
-            color="white",
-            bg_color="black",
-            font=os.path.join("fonts", "trebuchet.TTF"),
-        )
+        ImageClip(text_image, transparent=True)
         .set_opacity(0.6)
         .set_start(start_time)
         .set_duration(duration)
@@ -143,110 +548,330 @@ def add_subtitle(text, start_time, duration):
     return text_clip
 
 
-def get_subtitle_clips(transcript, seconds_per_segment: int = 3):
-    subtitle_clips = []
+def get_subtitle_segments(words, seconds_per_segment: int = 3, end_time=None):
+    subtitle_segments = []
     segment_start_time = 0.0
     segment_text = ""
 
-    for result in transcript:
-        for word_info in result.alternatives[0].words:
-            word_start_time = word_info.start_time.total_seconds()
-            text = word_info.word
+    for text, word_start_time in words:
+        if word_start_time - segment_start_time >= seconds_per_segment:
+            subtitle_segments.append(
+                (segment_text, segment_start_time, seconds_per_segment)
+            )
 
-            if word_start_time - segment_start_time >= seconds_per_segment:
-                subtitle_clip = add_subtitle(
-                    segment_text, segment_start_time, seconds_per_segment
-                )
-                subtitle_clips.append(subtitle_clip)
-
-                segment_start_time = word_start_time
-                segment_text = text + " "
-            else:
-                segment_text += text + " "
+            segment_start_time = word_start_time
+            segment_text = text + " "
+        else:
+            segment_text += text + " "
 
     # Add the last segment
     if segment_text:
-        final_duration = word_start_time - segment_start_time
-        subtitle_clip = add_subtitle(
-            segment_text, segment_start_time, final_duration
-        )
-        subtitle_clips.append(subtitle_clip)
+        final_duration = (end_time or word_start_time) - segment_start_time
+        subtitle_segments.append((segment_text, segment_start_time, final_duration))
 
-    return subtitle_clips
+    return subtitle_segments
 
 
-def add_background_music(video, music_file, volume=0.4):
-    background_music = AudioFileClip(music_file).volumex(volume)
-    video_audio = video.audio
-    final_audio = CompositeAudioClip(
-        [video_audio, background_music.set_duration(video.duration)]
-    )
-    video = video.set_audio(final_audio)
-    return video
+def get_subtitle_clips(subtitle_segments):
+    return [
+        add_subtitle(text, start_time, duration)
+        for text, start_time, duration in subtitle_segments
+    ]
+
+
+def frame_count(duration, fps):
+    # Segments last their narration rounded up to a whole frame, on every
+    # backend.
+    return math.ceil(round(duration * fps, 6))
+
+
+def audio_duration(audio_path):
+    with wave.open(audio_path, "rb") as audio:
+        return audio.getnframes() / audio.getframerate()
+
+
+def scene_timeline(scenes, fps):
+    # Start time of each scene on the joined timeline (see frame_count).
+    start_times = []
+    current_time = 0.0
+    for clip in scenes:
+        start_times.append(current_time)
+        current_time += frame_count(audio_duration(clip["audio_path"]), fps) / fps
+
+    return start_times, current_time
+
+
+def narration_word_timings(scenes, fps):
+    # Offsets each scene's TTS word timepoints by the scene's start time on the
+    # joined timeline. Returns None when any scene has no timepoints.
+    if not all(clip.get("word_timings") for clip in scenes):
+        return None
+
+    start_times, end_time = scene_timeline(scenes, fps)
+    words = [
+        (word, scene_start_time + start_time)
+        for clip, scene_start_time in zip(scenes, start_times)
+        for word, start_time in clip["word_timings"]
+    ]
+    return words, end_time
+
+
+def get_http_session():
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            _http_session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS
+            )
+            _http_session.mount("http://", adapter)
+            _http_session.mount("https://", adapter)
+    return _http_session
 
 
 def download_media(media_url, user_media_path: str):
-        response = requests.get(media_url)
-        response.raise_for_status()
+    parsed_url = urlparse(media_url)
+    filename = os.path.basename(parsed_url.path)
+    file_path = os.path.join(user_media_path, "media", filename)
+    with _download_locks_lock:
+        file_lock = _download_locks.setdefault(file_path, threading.Lock())
+
+    # Scenes that share a URL wait for the first download instead of racing
+    # on the same .part file.
+    with file_lock:
+        if not os.path.exists(file_path):
+            stream_to_file(media_url, file_path)
+
+    with _download_locks_lock:
+        _download_locks.pop(file_path, None)
+
+    return file_path
+
+
+def stream_to_file(media_url, file_path):
+    part_path = file_path + ".part"
+
+    # Streams to a .part file and resumes with an HTTP Range request if the
+    # connection drops, so large files are never held in memory.
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        downloaded = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={downloaded}-"} if downloaded else {}
+        try:
+            with get_http_session().get(
+                media_url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT
+            ) as response:
+                if response.status_code == 416:
+                    break
+                response.raise_for_status()
+                mode = "ab" if response.status_code == 206 else "wb"
+                with open(part_path, mode) as file:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        file.write(chunk)
+            break
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ) as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            log.warning(f"Download of {media_url} interrupted, resuming: {e}")
+
+    os.replace(part_path, file_path)
+
+
+def download_stock_media(media_url, user_media_path: str):
+    # Stock assets are immutable per URL, so they are shared across requests
+    # and worker processes through STOCK_CACHE.
+    parsed_url = urlparse(media_url)
+    filename = os.path.basename(parsed_url.path)
+    cache_key = hash_key(media_url) + os.path.splitext(filename)[1].lower()
+    file_path = os.path.join(user_media_path, "media", filename)
+
+    cached_path = STOCK_CACHE.get(cache_key)
+    if cached_path is not None:
+        try:
+            return link_or_copy(cached_path, file_path)
+        except FileNotFoundError:
+            pass
+
+    download_media(media_url, user_media_path=user_media_path)
+    temp_path = STOCK_CACHE.reserve(cache_key)
+    link_or_copy(file_path, temp_path)
+    STOCK_CACHE.commit(temp_path, cache_key)
+    return file_path
+
+
+def store_user_media(file_path, content_hash: str):
+    cache_key = content_hash + os.path.splitext(file_path)[1].lower()
+    if MEDIA_STORE.get(cache_key) is None:
+        temp_path = MEDIA_STORE.reserve(cache_key)
+        link_or_copy(file_path, temp_path)
+        MEDIA_STORE.commit(temp_path, cache_key)
+    return cache_key
+
+
+def download_user_media(media_url, user_media_path: str):
+    filename = os.path.basename(unquote(urlparse(media_url).path))
+    file_path = os.path.join(user_media_path, "media", filename)
+    match = CONTENT_NAME_PATTERN.match(filename)
+
+    if match:
+        cached_path = MEDIA_STORE.get(match.group(1) + (match.group(2) or "").lower())
+        if cached_path is not None:
+            try:
+                return link_or_copy(cached_path, file_path)
+            except FileNotFoundError:
+                pass
+
+    download_media(media_url, user_media_path=user_media_path)
+    # Only verified content goes into the store.
+    if match and hash_file(file_path) == match.group(1):
+        store_user_media(file_path, match.group(1))
+    return file_path
 
-        parsed_url = urlparse(media_url)
-        filename = os.path.basename(parsed_url.path)
-        file_path = os.path.join(user_media_path, "media", filename)
 
-        with open(file_path, "wb") as file:
-            file.write(response.content)
+def download_scene(index, clip, user_media_path: str):
+    if clip["type"].startswith("stock"):
+        clip["media_path"] = download_stock_media(clip["media_url"], user_media_path)
+    else:
+        clip["media_path"] = download_user_media(clip["media_url"], user_media_path)
+    return clip
+
+
+def get_tts_client():
+    global _tts_client
+    with _tts_client_lock:
+        if _tts_client is None:
+            _tts_client = tts.TextToSpeechClient(
+                client_options={"api_key": os.getenv("SPEECH_API_KEY")}
+            )
+    return _tts_client
+
+
+def narration_ssml(text):
+    words = text.split()
+    marks = " ".join(
+        f'<mark name="{index}"/>{escape(word)}' for index, word in enumerate(words)
+    )
+    return words, f"<speak>{marks}</speak>"
 
-        return file_path
 
 def text_to_speech(text, out_name, user_media_path: str):
-    text_input = tts.SynthesisInput(text=text)
     voice_params = tts.VoiceSelectionParams(
-        language_code="en-US", name="en-US-Studio-O"
+        language_code=TTS_LANGUAGE_CODE, name=TTS_VOICE_NAME
     )
     audio_config = tts.AudioConfig(audio_encoding=tts.AudioEncoding.LINEAR16)
 
-    client = tts.TextToSpeechClient(
-        client_options={"api_key": os.getenv("SPEECH_API_KEY")}
+    cache_key = hash_key(
+        text,
+        TTS_LANGUAGE_CODE,
+        TTS_VOICE_NAME,
+        tts.AudioConfig.to_json(audio_config),
+        TTS_TIMEPOINTS,
     )
-    response = client.synthesize_speech(
-        input=text_input,
-        voice=voice_params,
-        audio_config=audio_config,
-    )
-
     file_path = os.path.join(user_media_path, "audio", f"{out_name}.wav")
-    with open(file_path, "wb") as out:
-        out.write(response.audio_content)
+    cached_path = TTS_CACHE.get(cache_key)
+    timings_path = TTS_TIMEPOINT_CACHE.get(cache_key)
+
+    if cached_path is not None and timings_path is not None:
+        # Another worker can evict either entry before it is read or linked.
+        try:
+            with open(timings_path, "r") as file:
+                word_timings = json.load(file)
+            return link_or_copy(cached_path, file_path), word_timings
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    word_timings = None
+    response = None
+    if TTS_TIMEPOINTS:
+        words, ssml = narration_ssml(text)
+        try:
+            response = get_tts_client().synthesize_speech(
+                input=tts.SynthesisInput(ssml=ssml),
+                voice=voice_params,
+                audio_config=audio_config,
+                enable_time_pointing=[
+                    tts.SynthesizeSpeechRequest.TimepointType.SSML_MARK
+                ],
+            )
+            word_timings = [
+                [words[int(timepoint.mark_name)], timepoint.time_seconds]
+                for timepoint in response.timepoints
+            ]
+        except InvalidArgument as e:
+            log.warning(f"Voice rejected SSML marks, synthesizing plain text: {e}")
+
+    if response is None:
+        response = get_tts_client().synthesize_speech(
+            input=tts.SynthesisInput(text=text),
+            voice=voice_params,
+            audio_config=audio_config,
+        )
+
+    # The request copy is written from the response, so an eviction right
+    # after the put cannot lose it.
+    with open(file_path, "wb") as file:
+        file.write(response.audio_content)
+    TTS_CACHE.put_bytes(cache_key, response.audio_content)
+    TTS_TIMEPOINT_CACHE.put_bytes(cache_key, json.dumps(word_timings).encode())
+
+    return file_path, word_timings
+
+
+def synthesize_scene_narration(index, clip, user_media_path: str):
+    # Named by scene index alone: scenes whose segments are reused are never
+    # downloaded, so they have no media_path.
+    clip["audio_path"], clip["word_timings"] = text_to_speech(
+        clip["script"], f"{index}_narration", user_media_path=user_media_path
+    )
+    return clip
 
-    return file_path
 
 def speech_to_text(audio_path: str, sample_rate):
+    # Fallback for subtitles when TTS timepoints are unavailable. Audio is
+    # split on frame boundaries into chunks under the synchronous recognition
+    # limit, each with its own WAV header, and word times are offset by the
+    # chunk start so they stay on the full timeline.
     client = speech.SpeechClient(
         client_options={"api_key": os.getenv("SPEECH_API_KEY")}
     )
 
-    with io.open(audio_path, "rb") as audio_file:
-        content = audio_file.read()
-
-    # Split the content into chunks
-    chunk_size = 10 * 1024 * 1024 - 1000  # Slightly less than 10 MB
-    chunks = [
-        content[i : i + chunk_size] for i in range(0, len(content), chunk_size)
-    ]
-
-    all_results = []
+    with wave.open(audio_path, "rb") as audio_file:
+        params = audio_file.getparams()
+        frames_per_chunk = STT_CHUNK_SECONDS * params.framerate
+        chunks = []
+        while True:
+            frames = audio_file.readframes(frames_per_chunk)
+            if not frames:
+                break
+            chunk = io.BytesIO()
+            with wave.open(chunk, "wb") as chunk_file:
+                chunk_file.setparams(params)
+                chunk_file.writeframes(frames)
+            chunks.append(chunk.getvalue())
+
+    config = speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+        sample_rate_hertz=sample_rate,
+        language_code="en-US",
+        audio_channel_count=params.nchannels,
+        enable_word_time_offsets=True,
+    )
 
-    for chunk in chunks:
+    words = []
+    for index, chunk in enumerate(chunks):
+        chunk_start_time = index * STT_CHUNK_SECONDS
         audio = speech.RecognitionAudio(content=chunk)
-        config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=sample_rate,
-            language_code="en-US",
-            audio_channel_count=2,
-            enable_word_time_offsets=True,
-        )
-
         response = client.recognize(config=config, audio=audio)
-        all_results.extend(response.results)
+        for result in response.results:
+            for word_info in result.alternatives[0].words:
+                words.append(
+                    (
+                        word_info.word,
+                        chunk_start_time + word_info.start_time.total_seconds(),
+                    )
+                )
 
-    return all_results
+    return words